@@ -0,0 +1,208 @@
+import math
+import threading
+import time
+
+from flask import g, jsonify, request
+
+# (max concurrent requests, max queued requests) per endpoint class
+DEFAULT_LIMITS = {
+    'read': (32, 64),
+    'checkout': (4, 16),
+    'write': (8, 32),
+    'admin': (4, 8),
+    # Change feed connections are held open (long-poll wait, SSE stream), so they get their
+    # own cap and no queue instead of taking read slots away from the shop
+    'feed': (64, 0),
+}
+DEFAULT_QUEUE_TIMEOUT = 2.0
+# Token bucket for non-GET requests per client: refill rate (tokens/sec) and burst size
+DEFAULT_WRITE_RATE = 2.0
+DEFAULT_WRITE_BURST = 10
+# Health checks and static files are never shed, so the server stays observable under load
+EXEMPT_ENDPOINTS = ('api.health_check', 'static')
+CHECKOUT_PATHS = ('/checkout', '/api/v1/orders')
+FEED_PATHS = ('/api/v1/changes', '/api/v1/changes/stream')
+
+
+def hold_admission_slot():
+    """Keep the current request's admission slot past the end of the view.
+
+    For streamed views (SSE) whose work happens after the view returns. The slot is
+    no longer released at teardown; the returned callable releases it (only the first
+    call counts) and must be called when the stream ends. Every other response gives
+    its slot back in teardown_request.
+    """
+    limiter = g.pop('admission_limiter', None)
+    if limiter is None:
+        return lambda: None
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            limiter.release()
+    return release
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests of one class; excess requests wait in a bounded queue."""
+
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        with self._cond:
+            if self.in_flight < self.max_concurrent and self.waiting == 0:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                ok = self._cond.wait_for(lambda: self.in_flight < self.max_concurrent, timeout)
+            finally:
+                self.waiting -= 1
+            if not ok:
+                self.timed_out += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets. take() returns 0 if allowed, else seconds until a token is free."""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            self.limited += 1
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # A bucket idle long enough to be full again carries no state worth keeping
+        full_after = self.burst / self.rate
+        for key, (_, last) in list(self._buckets.items()):
+            if now - last >= full_after:
+                del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'clients': len(self._buckets), 'limited': self.limited}
+
+
+class AdmissionControl:
+    """Load shedding for the Flask app.
+
+    Requests are classified as read / checkout / write / admin / feed. Each class has a
+    concurrency cap with a bounded wait queue; when the queue is full or the wait
+    times out the request gets an immediate 503 with Retry-After instead of piling
+    up behind SQLite's busy timeout. Non-GET requests are also rate limited per
+    client address (429). Configured via app.config ADMISSION_LIMITS,
+    ADMISSION_QUEUE_TIMEOUT, ADMISSION_WRITE_RATE and ADMISSION_WRITE_BURST.
+    """
+
+    def __init__(self, app=None):
+        self.limiters = {}
+        self.write_buckets = None
+        self.queue_timeout = DEFAULT_QUEUE_TIMEOUT
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        limits = dict(DEFAULT_LIMITS)
+        limits.update(app.config.get('ADMISSION_LIMITS', {}))
+        self.limiters = {name: ConcurrencyLimiter(name, *limit) for name, limit in limits.items()}
+        self.queue_timeout = app.config.get('ADMISSION_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT)
+        self.write_buckets = TokenBucketLimiter(app.config.get('ADMISSION_WRITE_RATE', DEFAULT_WRITE_RATE),
+                                                app.config.get('ADMISSION_WRITE_BURST', DEFAULT_WRITE_BURST))
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['admission'] = self
+
+    @staticmethod
+    def classify(req):
+        if req.path.startswith('/admin'):
+            return 'admin'
+        if req.path in FEED_PATHS:
+            return 'feed'
+        if req.method == 'POST' and req.path in CHECKOUT_PATHS:
+            return 'checkout'
+        if req.method in ('GET', 'HEAD', 'OPTIONS'):
+            return 'read'
+        return 'write'
+
+    def _before_request(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        endpoint_class = self.classify(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            retry_after = self.write_buckets.take(request.remote_addr or 'unknown')
+            if retry_after:
+                return self._reject(429, 'RATE_LIMITED', 'Too many requests', retry_after)
+        limiter = self.limiters[endpoint_class]
+        if not limiter.acquire(self.queue_timeout):
+            return self._reject(503, 'SERVER_OVERLOADED', 'Server is overloaded, please retry later', 1)
+        g.admission_limiter = limiter
+        return None
+
+    def _teardown_request(self, exc=None):
+        limiter = g.pop('admission_limiter', None)
+        if limiter is not None:
+            limiter.release()
+
+    @staticmethod
+    def _reject(status_code, code, message, retry_after):
+        response = jsonify({'error': message, 'code': code, 'status': status_code})
+        response.status_code = status_code
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def stats(self):
+        return {
+            'classes': {name: limiter.stats() for name, limiter in self.limiters.items()},
+            'write_rate_limit': self.write_buckets.stats() if self.write_buckets else None,
+        }
@@ -1,15 +1,31 @@
 import os
 from flask import Flask, render_template, session
 from models import init_db
+from admission import AdmissionControl
+from maintenance import MaintenanceScheduler
+from suggest import product_index
 from routes.feedback import feedback_bp
 from routes.admin import admin_bp
 from routes.shop import shop_bp
 from routes.api import api_bp
+from routes.media import media_bp
 
 app = Flask(__name__)
 app.secret_key = '1234'  # Необхідно для роботи з сесіями
 # Пароль адміністратора: можна встановити змінною оточення ADMIN_PASSWORD
 app.config['ADMIN_PASSWORD'] = os.environ.get('ADMIN_PASSWORD', 'prikol123')
+# Токен для адмінських API-запитів без сесії (Authorization: Bearer <token>); не задано — лише сесія адміна
+app.config['ADMIN_API_TOKEN'] = os.environ.get('ADMIN_API_TOKEN')
+# Каталог для завантажених зображень товарів (файли зберігаються під SHA-256 хешем вмісту)
+app.config['MEDIA_ROOT'] = os.environ.get('MEDIA_ROOT', os.path.join(app.root_path, 'media'))
+app.config['MEDIA_MAX_BYTES'] = 5 * 1024 * 1024
+# Ліміт тіла запиту трохи більший за MEDIA_MAX_BYTES (запас на multipart-заголовки): більші завантаження отримують 413, не читаючись у пам'ять
+app.config['MAX_CONTENT_LENGTH'] = app.config['MEDIA_MAX_BYTES'] + 64 * 1024
+# Фонове обслуговування БД (PRAGMA optimize, WAL checkpoint, incremental vacuum, резервні копії).
+# Вимкнене при імпорті: вмикайте MAINTENANCE_ENABLED=1 лише в одному процесі (не в кожному воркері gunicorn)
+# або запускайте `python maintenance.py all` з cron
+app.config['MAINTENANCE_ENABLED'] = os.environ.get('MAINTENANCE_ENABLED', '0') == '1'
+app.config['MAINTENANCE_BACKUP_DIR'] = os.environ.get('MAINTENANCE_BACKUP_DIR')
 
 # Ініціалізація Flasgger для документації API (опціонально)
 try:
@@ -25,12 +41,19 @@ except ImportError:
 
 # Ініціалізація бази даних
 init_db()
+# Індекс підказок назв товарів будується у фоні, поки перші запити обслуговуються з БД
+product_index.start()
+
+# Обмеження одночасних запитів (read / checkout / write / admin) та швидкий 503 при перевантаженні
+admission = AdmissionControl(app)
+maintenance = MaintenanceScheduler(app)
 
 # Реєстрація блюпрінтів
 app.register_blueprint(feedback_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(shop_bp)
 app.register_blueprint(api_bp)
+app.register_blueprint(media_bp)
 
 @app.route('/')
 def home():
@@ -41,4 +64,8 @@ def about():
     return render_template('about.html')
 
 if __name__ == '__main__':
+    # Dev-сервер — єдиний процес, тож обслуговування запускаємо тут; з reloader'ом лише в дочірньому
+    # процесі, що обслуговує запити (WERKZEUG_RUN_MAIN), а не в батьківському, що стежить за файлами
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        maintenance.start()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Regression check: admission control slots are given back.
+
+Starts the app on a real werkzeug server (the test client closes responses
+differently) against a throwaway database, then:
+- downloads a /media/ file more times than the read class allows in flight
+  (file responses are direct_passthrough, their close callbacks never run) and
+  checks /api/v1/health reports read in_flight == 0 and /shop still answers;
+- opens an SSE change stream, checks it holds one feed slot while open and
+  that the slot is free again after the client disconnects.
+
+    python check_admission.py
+"""
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='check-admission-')
+    os.environ['DATABASE'] = os.path.join(workdir, 'check.sqlite')
+    os.environ['MEDIA_ROOT'] = os.path.join(workdir, 'media')
+    os.environ['MAINTENANCE_ENABLED'] = '0'
+    from werkzeug.datastructures import FileStorage
+    from werkzeug.serving import make_server
+    from app import app
+    from media import store_image
+
+    with app.app_context():
+        url = store_image(FileStorage(io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'\0' * 64), 'check.png'))['url']
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    admission = app.extensions['admission']
+    # The server only notices an SSE client went away on its next write (heartbeat)
+    app.config['CHANGE_STREAM_HEARTBEAT_SECONDS'] = 0.2
+
+    def in_flight():
+        with urllib.request.urlopen(base + '/api/v1/health') as response:
+            classes = json.load(response)['data']['admission']['classes']
+        return {name: stats['in_flight'] for name, stats in classes.items()}
+
+    def wait_for(name, expected):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if in_flight()[name] == expected:
+                return True
+            time.sleep(0.05)
+        return False
+
+    problems = []
+    try:
+        downloads = admission.limiters['read'].max_concurrent + 5
+        for n in range(downloads):
+            try:
+                with urllib.request.urlopen(base + url) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                problems.append(f'/media/ download {n + 1} of {downloads} answered {e.code}')
+                break
+        if not problems and not wait_for('read', 0):
+            problems.append(f'read in_flight is {in_flight()["read"]} after {downloads} /media/ downloads')
+        with urllib.request.urlopen(base + '/shop', timeout=5) as response:
+            if response.status != 200:
+                problems.append(f'/shop answered {response.status}')
+
+        stream = urllib.request.urlopen(base + '/api/v1/changes/stream')
+        stream.readline()
+        if not wait_for('feed', 1):
+            problems.append(f'an open SSE stream holds {in_flight()["feed"]} feed slots, expected 1')
+        stream.close()
+        if not wait_for('feed', 0):
+            problems.append(f'feed in_flight is {in_flight()["feed"]} after the SSE client disconnected')
+    except urllib.error.HTTPError as e:
+        problems.append(f'{e.url} answered {e.code} (leaked slots fill the class)')
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if problems:
+        print('FAILED:')
+        for problem in problems:
+            print(' -', problem)
+        return 1
+    print('OK: admission slots are released after file downloads and SSE streams')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import sqlite3
+import time
+from functools import wraps
+
+from flask import current_app, g, jsonify, make_response, request
+
+from models import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    get_idempotency_key,
+    release_idempotency_key
+)
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_WAIT_TIMEOUT = 10.0
+DEFAULT_PENDING_TIMEOUT = 60.0
+POLL_INTERVAL = 0.05
+# Only these headers of the original response are replayed
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+def _error(message, code, status_code, retry_after=None):
+    response = jsonify({'error': message, 'code': code, 'status': status_code})
+    response.status_code = status_code
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _unavailable():
+    # Own code, so clients and load tests can tell it from admission control's SERVER_OVERLOADED
+    return _error('Idempotency key store is busy, please retry later', 'IDEMPOTENCY_STORE_BUSY', 503, retry_after=1)
+
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    if request.form:
+        digest.update(json.dumps(sorted((k, v) for k, v in request.form.items(multi=True) if k != FORM_FIELD)).encode())
+    return digest.hexdigest()
+
+
+def _release(scope, key):
+    # Best effort: a key we fail to release is evicted after IDEMPOTENCY_PENDING_TIMEOUT anyway
+    try:
+        release_idempotency_key(scope, key)
+    except sqlite3.OperationalError as e:
+        current_app.logger.warning('Could not release idempotency key %s/%s: %s', scope, key, e)
+
+
+def _replay(row, rebuild):
+    if row['status'] == 'committed':
+        response = make_response(rebuild(row['result_id']))
+    else:
+        response = make_response(row['response_body'] or b'', row['response_status'])
+        for name, value in json.loads(row['response_headers'] or '{}').items():
+            response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope, on_replay=None, rebuild=None, on_unavailable=None):
+    """Make an order-creating view safe to retry.
+
+    When the request carries an Idempotency-Key header (or an idempotency_key form
+    field) the first request with that key runs the view. Keys are scoped per client
+    address, so one client's key never replays another client's response. Retries with
+    the same key get the first response back without running the view; a concurrent
+    duplicate waits for the first request to finish. Reusing a key with a different
+    payload is a 422.
+
+    The view gets (scope, key) in g.idempotency_key. When it passes that to add_order
+    the key is marked committed in the order's own transaction and the view sets
+    g.idempotency_committed; replays are then built by rebuild(order_id), so a committed
+    order can never be created twice and no extra write is needed to store the response.
+    Other responses are stored in idempotency_keys for IDEMPOTENCY_TTL seconds, except
+    status >= 500 or when the view sets g.idempotency_discard, so the client can retry
+    for real. If SQLite is too busy to check the key the request is not run and gets a
+    503 IDEMPOTENCY_STORE_BUSY (or whatever on_unavailable returns).
+    - on_replay: callback run before a stored response is returned
+    - rebuild: builds the response for a committed key from its order id
+    - on_unavailable: response to return instead of the JSON 503
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+            if not key:
+                return f(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(f'{HEADER} is too long', 'INVALID_IDEMPOTENCY_KEY', 400)
+
+            config = current_app.config
+            client_scope = f'{scope}:{request.remote_addr or "unknown"}'
+            fingerprint = _fingerprint()
+            try:
+                claimed, row = claim_idempotency_key(client_scope, key, fingerprint,
+                                                     config.get('IDEMPOTENCY_TTL', DEFAULT_TTL),
+                                                     config.get('IDEMPOTENCY_PENDING_TIMEOUT', DEFAULT_PENDING_TIMEOUT))
+                if not claimed:
+                    if row is not None and row['fingerprint'] != fingerprint:
+                        return _error(f'{HEADER} was already used with a different request',
+                                      'IDEMPOTENCY_KEY_REUSED', 422)
+                    # Wait for the first request with this key instead of racing it
+                    deadline = time.monotonic() + config.get('IDEMPOTENCY_WAIT_TIMEOUT', DEFAULT_WAIT_TIMEOUT)
+                    while row is not None and row['status'] == 'pending' and time.monotonic() < deadline:
+                        time.sleep(POLL_INTERVAL)
+                        row = get_idempotency_key(client_scope, key)
+            except sqlite3.OperationalError as e:
+                current_app.logger.warning('Idempotency key check failed for %s/%s: %s', client_scope, key, e)
+                return on_unavailable() if on_unavailable else _unavailable()
+            if not claimed:
+                if row is None:
+                    # The first request failed and released the key, so claim it ourselves
+                    return wrapper(*args, **kwargs)
+                if row['status'] == 'pending':
+                    return _error('A request with this key is still in progress',
+                                  'IDEMPOTENCY_IN_PROGRESS', 409, retry_after=1)
+                if on_replay:
+                    on_replay()
+                return _replay(row, rebuild)
+
+            g.idempotency_key = (client_scope, key)
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                if not g.get('idempotency_committed'):
+                    _release(client_scope, key)
+                raise
+            if g.pop('idempotency_committed', False):
+                # Final state was written together with the order
+                return response
+            if response.status_code >= 500 or g.pop('idempotency_discard', False):
+                _release(client_scope, key)
+                return response
+            headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+            try:
+                complete_idempotency_key(client_scope, key, response.status_code, json.dumps(headers), response.get_data())
+            except sqlite3.OperationalError as e:
+                # Nothing was committed by the view, so a retry after the pending timeout may safely run it again
+                current_app.logger.warning('Could not store idempotent response for %s/%s: %s', client_scope, key, e)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,250 @@
+import argparse
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import models
+from models import get_db_connection, get_maintenance_runs, record_maintenance_run
+
+logger = logging.getLogger(__name__)
+
+# Seconds between runs of each task when running as a background scheduler
+DEFAULT_INTERVALS = {
+    'checkpoint': 5 * 60,
+    'optimize': 60 * 60,
+    'incremental_vacuum': 60 * 60,
+    'backup': 24 * 60 * 60,
+}
+BACKUP_KEEP = 7
+INCREMENTAL_VACUUM_PAGES = 1000
+
+# In-progress state of this process (running flag, backup progress); finished runs are stored in maintenance_runs
+_status = {}
+_status_lock = threading.Lock()
+
+
+def _record(task, **fields):
+    with _status_lock:
+        _status.setdefault(task, {}).update(fields)
+
+
+def get_status():
+    """Last run of every maintenance task: start and finish time, duration, result or error.
+
+    Finished runs come from the maintenance_runs table, so runs made by another process
+    (cron) are reported too; tasks running in this process add running=True and, for a
+    backup, its progress.
+    """
+    try:
+        status = get_maintenance_runs()
+    except sqlite3.Error as e:
+        logger.warning('Could not read maintenance runs: %s', e)
+        status = {}
+    with _status_lock:
+        for task, fields in _status.items():
+            if fields.get('running'):
+                status.setdefault(task, {}).update(fields)
+    return status
+
+
+def _run(task, func, *args):
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    started = time.perf_counter()
+    _record(task, running=True, started_at=started_at)
+    result = error = None
+    try:
+        result = func(*args)
+    except Exception as e:
+        error = str(e)
+        logger.exception('Maintenance task %s failed', task)
+    duration = round(time.perf_counter() - started, 3)
+    with _status_lock:
+        _status.pop(task, None)
+    try:
+        record_maintenance_run(task, error is None, started_at, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                               duration, result, error)
+    except sqlite3.Error as e:
+        logger.warning('Could not record maintenance run of %s: %s', task, e)
+    return result
+
+
+def optimize():
+    """Refresh query planner statistics: a full ANALYZE the first time, PRAGMA optimize afterwards."""
+    conn = get_db_connection()
+    analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if analyzed:
+        conn.execute('PRAGMA optimize')
+    else:
+        conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return {'full_analyze': not analyzed}
+
+
+def checkpoint():
+    """Copy the WAL back into the database file and truncate it."""
+    conn = get_db_connection()
+    busy, log_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    conn.close()
+    return {'busy': bool(busy), 'log_pages': log_pages, 'checkpointed_pages': checkpointed}
+
+
+def incremental_vacuum(pages=INCREMENTAL_VACUUM_PAGES):
+    """Return up to `pages` free pages to the OS. Needs auto_vacuum=INCREMENTAL (see enable_incremental_vacuum)."""
+    conn = get_db_connection()
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.close()
+        return {'skipped': 'auto_vacuum is not INCREMENTAL'}
+    freelist_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    conn.commit()
+    freelist_after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.close()
+    return {'freed_pages': freelist_before - freelist_after, 'free_pages_left': freelist_after}
+
+
+def enable_incremental_vacuum():
+    """One-off switch to auto_vacuum=INCREMENTAL. Rewrites the whole file with VACUUM, so run it offline."""
+    conn = get_db_connection()
+    conn.isolation_level = None
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    conn.close()
+    return {'auto_vacuum': mode}
+
+
+def backup(backup_dir, keep=BACKUP_KEEP):
+    """Online backup through sqlite3.Connection.backup, copied in a single step.
+    In WAL mode the copy only holds a read snapshot, so writers carry on meanwhile. (A
+    step-wise copy restarts whenever another connection writes to the source, and under
+    steady traffic never finishes.) Writes <backup_dir>/db-<timestamp>.sqlite and keeps
+    the newest `keep` copies.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    target = os.path.join(backup_dir, f'db-{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}.sqlite')
+    partial = target + '.part'
+
+    def progress(status, remaining, total):
+        _record('backup', pages_total=total, pages_remaining=remaining)
+
+    source = get_db_connection()
+    dest = sqlite3.connect(partial)
+    copied = False
+    try:
+        source.backup(dest, pages=-1, progress=progress)
+        copied = True
+    finally:
+        dest.close()
+        source.close()
+        # A failed copy must not leave a half-written .part file behind
+        if not copied and os.path.exists(partial):
+            os.remove(partial)
+    # Only a finished copy gets the final name
+    os.replace(partial, target)
+
+    backups = sorted(glob.glob(os.path.join(backup_dir, 'db-*.sqlite')))
+    for old in backups[:-keep] if keep else []:
+        os.remove(old)
+    return {'path': target, 'size': os.path.getsize(target)}
+
+
+class MaintenanceScheduler:
+    """Background thread that runs the maintenance tasks on their intervals.
+
+    Configured via app.config: MAINTENANCE_ENABLED, MAINTENANCE_INTERVALS (seconds
+    per task), MAINTENANCE_BACKUP_DIR (backups are skipped when unset) and
+    MAINTENANCE_BACKUP_KEEP. Task results are stored in the maintenance_runs table,
+    returned by get_status() and reported by /api/v1/health.
+
+    Only one process should run it: init_app starts the thread only when
+    MAINTENANCE_ENABLED is set (off by default), otherwise call start() from the
+    designated process, or run `python maintenance.py all` from cron instead.
+    """
+
+    def __init__(self, app=None):
+        self.intervals = dict(DEFAULT_INTERVALS)
+        self.backup_dir = None
+        self.backup_keep = BACKUP_KEEP
+        self._next_run = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.intervals.update(app.config.get('MAINTENANCE_INTERVALS', {}))
+        self.backup_dir = app.config.get('MAINTENANCE_BACKUP_DIR')
+        self.backup_keep = app.config.get('MAINTENANCE_BACKUP_KEEP', BACKUP_KEEP)
+        app.extensions['maintenance'] = self
+        if app.config.get('MAINTENANCE_ENABLED', False):
+            self.start()
+
+    def _tasks(self):
+        tasks = {
+            'checkpoint': (checkpoint,),
+            'optimize': (optimize,),
+            'incremental_vacuum': (incremental_vacuum,),
+        }
+        if self.backup_dir:
+            tasks['backup'] = (backup, self.backup_dir, self.backup_keep)
+        return tasks
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        now = time.monotonic()
+        # Statistics first (cheap and most useful), everything else after its first interval
+        self._next_run = {task: now + (0 if task == 'optimize' else interval)
+                          for task, interval in self.intervals.items()}
+        self._thread = threading.Thread(target=self._loop, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for task, (func, *args) in self._tasks().items():
+                if now >= self._next_run.get(task, now):
+                    _run(task, func, *args)
+                    self._next_run[task] = time.monotonic() + self.intervals[task]
+            next_due = min(self._next_run.values(), default=now + 60)
+            self._stop.wait(max(1.0, next_due - time.monotonic()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Обслуговування бази даних SQLite')
+    parser.add_argument('task', choices=('optimize', 'checkpoint', 'vacuum', 'enable-incremental-vacuum', 'backup', 'all'))
+    parser.add_argument('--db', help='шлях до бази даних (за замовчуванням DATABASE або db.sqlite)')
+    parser.add_argument('--backup-dir', default='backups', help='каталог для резервних копій')
+    parser.add_argument('--keep', type=int, default=BACKUP_KEEP, help='скільки останніх копій зберігати')
+    args = parser.parse_args(argv)
+    if args.db:
+        models.DATABASE = args.db
+
+    tasks = {
+        'optimize': [('optimize', optimize)],
+        'checkpoint': [('checkpoint', checkpoint)],
+        'vacuum': [('incremental_vacuum', incremental_vacuum)],
+        'enable-incremental-vacuum': [('enable_incremental_vacuum', enable_incremental_vacuum)],
+        'backup': [('backup', lambda: backup(args.backup_dir, args.keep))],
+    }
+    tasks['all'] = tasks['optimize'] + tasks['checkpoint'] + tasks['vacuum'] + tasks['backup']
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(name)s: %(message)s')
+    for name, func in tasks[args.task]:
+        _run(name, func)
+        status = get_status().get(name)
+        if status is None:
+            print(f'{name}: результат не збережено (див. журнал)')
+            continue
+        print(f"{name}: {'OK' if status['ok'] else 'ПОМИЛКА'} за {status['duration']} с — {status.get('result') or status.get('error')}")
+
+
+if __name__ == '__main__':
+    main()
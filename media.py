@@ -0,0 +1,172 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+
+from flask import current_app, g
+
+# Magic bytes -> extension. We trust the content, not the uploaded filename.
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+MEDIA_NAME_RE = re.compile(r'^([0-9a-f]{64})(?:-(\d+))?\.(png|jpg|gif|webp)$')
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_VARIANT_WIDTHS = (200, 400)
+PIL_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'gif': 'GIF', 'webp': 'WEBP'}
+
+logger = logging.getLogger(__name__)
+
+# Names of the size variants in the media directory, re-listed only when the directory's
+# mtime changes (any process adding or removing a file changes it)
+_variants = {'key': None, 'names': frozenset()}
+_variants_lock = threading.Lock()
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class MediaError(ValueError):
+    """Raised when an uploaded file is not an accepted image."""
+
+
+def media_root():
+    return current_app.config.get('MEDIA_ROOT') or os.path.join(current_app.root_path, 'media')
+
+
+def detect_image_type(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    for signature, ext in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    return None
+
+
+def media_url(filename):
+    return f'/media/{filename}'
+
+
+def _write_atomic(path, data):
+    # Write to a temp file in the same directory and rename, so a concurrent
+    # reader never sees a half-written file under the content-hash name
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _make_variants(path, digest, ext, widths):
+    """Pre-generate down-scaled copies (<hash>-<width>.<ext>) when Pillow is installed."""
+    if Image is None:
+        return []
+    created = []
+    try:
+        with Image.open(path) as img:
+            for width in widths:
+                if img.width <= width:
+                    continue
+                name = f'{digest}-{width}.{ext}'
+                target = os.path.join(os.path.dirname(path), name)
+                if not os.path.exists(target):
+                    height = max(1, round(img.height * width / img.width))
+                    buffer = io.BytesIO()
+                    img.resize((width, height)).save(buffer, format=PIL_FORMATS[ext])
+                    _write_atomic(target, buffer.getvalue())
+                created.append(name)
+    except Exception as e:
+        logger.warning('Could not create image variants for %s: %s', digest, e)
+    return created
+
+
+def store_image(file_storage):
+    """Store an uploaded image under its SHA-256 content hash.
+    Returns {'hash', 'filename', 'url', 'variants'}. Uploading the same bytes
+    twice reuses the existing file. Raises MediaError for empty, oversized or
+    non-image uploads.
+    """
+    max_bytes = current_app.config.get('MEDIA_MAX_BYTES', DEFAULT_MAX_BYTES)
+    data = file_storage.read(max_bytes + 1) if file_storage else b''
+    if not data:
+        raise MediaError('No image uploaded')
+    if len(data) > max_bytes:
+        raise MediaError(f'Image is larger than {max_bytes} bytes')
+    ext = detect_image_type(data)
+    if ext is None:
+        raise MediaError('Unsupported image format (expected PNG, JPEG, GIF or WebP)')
+
+    digest = hashlib.sha256(data).hexdigest()
+    filename = f'{digest}.{ext}'
+    root = media_root()
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, filename)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    widths = current_app.config.get('MEDIA_VARIANT_WIDTHS', DEFAULT_VARIANT_WIDTHS)
+    variants = _make_variants(path, digest, ext, widths)
+    return {'hash': digest, 'filename': filename, 'url': media_url(filename), 'variants': variants}
+
+
+def _variant_names():
+    """Variant file names in the media directory, looked up once per request."""
+    names = g.get('media_variant_names')
+    if names is not None:
+        return names
+    root = media_root()
+    try:
+        key = (root, os.stat(root).st_mtime_ns)
+    except FileNotFoundError:
+        names = frozenset()
+    else:
+        with _variants_lock:
+            if _variants['key'] != key:
+                _variants['names'] = frozenset(name for name in os.listdir(root)
+                                               if (match := MEDIA_NAME_RE.match(name)) and match.group(2))
+                _variants['key'] = key
+            names = _variants['names']
+    g.media_variant_names = names
+    return names
+
+
+def variant_url(url, width):
+    """Return the URL of a pre-generated <width> variant of a /media/ image if it exists."""
+    if not url or not url.startswith('/media/'):
+        return url
+    match = MEDIA_NAME_RE.match(url[len('/media/'):])
+    if not match or match.group(2):
+        return url
+    name = f'{match.group(1)}-{width}.{match.group(3)}'
+    if name in _variant_names():
+        return media_url(name)
+    return url
+
+
+def delete_image(url):
+    """Remove a stored /media/ image and its variants. Other URLs are ignored."""
+    if not url or not url.startswith('/media/'):
+        return
+    match = MEDIA_NAME_RE.match(url[len('/media/'):])
+    if not match or match.group(2):
+        return
+    root = media_root()
+    if not os.path.isdir(root):
+        return
+    digest, ext = match.group(1), match.group(3)
+    names = [f'{digest}.{ext}'] + [name for name in os.listdir(root) if name.startswith(f'{digest}-')]
+    for name in names:
+        try:
+            os.remove(os.path.join(root, name))
+        except FileNotFoundError:
+            pass
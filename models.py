@@ -1,13 +1,60 @@
+import json
+import logging
+import os
 import sqlite3
+from collections import OrderedDict
+import threading
+import time
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from records import Product, Order, OrderItem, Client, Feedback
+
+logger = logging.getLogger(__name__)
+
+# Шлях до бази даних; можна перевизначити змінною оточення DATABASE
+DATABASE = os.environ.get('DATABASE', 'db.sqlite')
+# Скільки секунд чекати на блокування SQLite (busy timeout)
+DB_TIMEOUT = float(os.environ.get('DB_TIMEOUT', '30'))
+CENTS = Decimal('0.01')
+# Default lower bounds of the price facet buckets (the last bucket is open-ended)
+PRICE_BUCKETS = (0, 500, 1000, 2000, 3000)
+# Facet counts per (catalog version, filters); least recently used entries are dropped first
+FACET_CACHE_SIZE = 256
+_facet_cache = OrderedDict()
+_facet_cache_lock = threading.Lock()
+# Change log: entries older than this are compacted, checked every N appended entries
+CHANGE_LOG_RETENTION = 7 * 24 * 60 * 60
+CHANGE_LOG_COMPACT_EVERY = 500
+# Wakes up in-process change feed waiters after a write commits
+_change_cond = threading.Condition()
+
+
+class CartError(ValueError):
+    """Raised when a cart cannot be priced (empty, bad quantity, unknown product)."""
 
 def get_db_connection():
-    conn = sqlite3.connect('db.sqlite', timeout=30.0, isolation_level='DEFERRED')
+    conn = sqlite3.connect(DATABASE, timeout=DB_TIMEOUT, isolation_level='DEFERRED')
     conn.row_factory = sqlite3.Row
     return conn
 
+
+def _fetch_records(conn, record_cls, query, params=()):
+    """Run a SELECT of record_cls.COLUMNS and build typed records straight from the row tuples."""
+    cur = conn.cursor()
+    cur.row_factory = record_cls.row_factory
+    return cur.execute(query, params).fetchall()
+
+
+def _fetch_record(conn, record_cls, query, params=()):
+    cur = conn.cursor()
+    cur.row_factory = record_cls.row_factory
+    return cur.execute(query, params).fetchone()
+
 def init_db():
     conn = get_db_connection()
+    # WAL: readers don't block the writer; maintenance.checkpoint() keeps the -wal file small
+    conn.execute('PRAGMA journal_mode = WAL')
     conn.execute('CREATE TABLE IF NOT EXISTS feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, email TEXT, message TEXT)')
     conn.execute('CREATE TABLE IF NOT EXISTS products (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, price REAL, image TEXT)')
     conn.execute('CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT, address TEXT, total_price REAL, status TEXT, date TEXT)')
@@ -17,6 +64,26 @@ def init_db():
     except Exception:
         pass
     conn.execute('CREATE TABLE IF NOT EXISTS order_items (id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER, product_id INTEGER, quantity INTEGER, FOREIGN KEY (order_id) REFERENCES orders (id), FOREIGN KEY (product_id) REFERENCES products (id))')
+    # Snapshot of the product at checkout time: the price the customer paid and the name
+    # they saw, so order reads don't depend on the current (or deleted) product row
+    for column in ('unit_price REAL', 'product_name TEXT', 'line_total REAL'):
+        try:
+            conn.execute(f'ALTER TABLE order_items ADD COLUMN {column}')
+        except Exception:
+            pass
+    # Counters and one-off migration markers (catalog_version is bumped by every product write)
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    # Backfill older rows from the current catalog (best available data for them), once.
+    # Lines whose product is already gone get a placeholder name and a zero price
+    if not conn.execute("SELECT 1 FROM meta WHERE key = 'order_items_snapshot_backfilled'").fetchone():
+        conn.execute('''UPDATE order_items SET
+                            unit_price = COALESCE((SELECT p.price FROM products p WHERE p.id = order_items.product_id), 0),
+                            product_name = COALESCE((SELECT p.name FROM products p WHERE p.id = order_items.product_id),
+                                                    'Товар #' || order_items.product_id)
+                        WHERE unit_price IS NULL''')
+        conn.execute('UPDATE order_items SET line_total = ROUND(unit_price * quantity, 2) WHERE line_total IS NULL')
+        conn.execute("INSERT INTO meta (key, value) VALUES ('order_items_snapshot_backfilled', 1)")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)')
     # Додаткова таблиця для клієнтів
     conn.execute('CREATE TABLE IF NOT EXISTS clients (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, email TEXT, phone TEXT, address TEXT)')
     # Спробуємо додати колонку has_courses якщо її ще немає (старі БД)
@@ -25,48 +92,161 @@ def init_db():
     except Exception:
         # Якщо колонка вже існує або SQLite не дозволяє — ігноруємо помилку
         pass
+    # Normalized search keys for indexed prefix search (filled from Python: SQLite's
+    # lower() only folds ASCII, and our names are mostly Cyrillic)
+    for column in ('name_lower TEXT', 'email_lower TEXT', 'phone_normalized TEXT'):
+        try:
+            conn.execute(f'ALTER TABLE clients ADD COLUMN {column}')
+        except Exception:
+            pass
+    rows = conn.execute('SELECT id, name, email, phone FROM clients WHERE email_lower IS NULL').fetchall()
+    conn.executemany('UPDATE clients SET name_lower = ?, email_lower = ?, phone_normalized = ? WHERE id = ?',
+                     [_client_search_keys(row['name'], row['email'], row['phone']) + (row['id'],) for row in rows])
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_clients_name_lower ON clients (name_lower)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_clients_email_lower ON clients (email_lower)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_clients_phone_normalized ON clients (phone_normalized)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_email ON orders (email)')
+    # Stored responses of order-creating requests, keyed by the client's Idempotency-Key
+    conn.execute('CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT NOT NULL, scope TEXT NOT NULL, fingerprint TEXT NOT NULL, status TEXT NOT NULL, response_status INTEGER, response_headers TEXT, response_body BLOB, created_at REAL NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (scope, key))')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)')
+    # Id of the order created under the key (status 'committed'), written in the order's transaction
+    try:
+        conn.execute('ALTER TABLE idempotency_keys ADD COLUMN result_id INTEGER')
+    except Exception:
+        pass
+    # Append-only log of writes to orders and feedback, read by the change feed (SSE / long-poll)
+    conn.execute('CREATE TABLE IF NOT EXISTS change_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, entity TEXT NOT NULL, entity_id INTEGER, action TEXT NOT NULL, payload TEXT, created_at REAL NOT NULL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_change_log_created_at ON change_log (created_at)')
+    # Last run of every maintenance task, shared by the in-app scheduler and `python maintenance.py` from cron
+    conn.execute('CREATE TABLE IF NOT EXISTS maintenance_runs (task TEXT PRIMARY KEY, ok INTEGER NOT NULL, started_at TEXT NOT NULL, finished_at TEXT NOT NULL, duration REAL NOT NULL, result TEXT, error TEXT)')
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', 0)")
     conn.commit()
     conn.close()
 
-def get_products(q=None, min_price=None, max_price=None, has_image=None):
+def _parse_price(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def get_products(q=None, min_price=None, max_price=None, has_image=None, facets=False, price_buckets=None):
     """Return products optionally filtered by search term (q), price range and whether they have an image.
     - q: substring to search in product name
     - min_price, max_price: numeric bounds
     - has_image: True to require non-empty image, None/False to ignore
+    - facets: also return facet counts, as (products, facets)
+    - price_buckets: ascending lower bounds of the price buckets (default PRICE_BUCKETS)
+    All filters are applied in SQL. Facets come from one aggregate query over the
+    q-filtered products, where each facet ignores its own filter (price buckets honour
+    q and has_image, image counts honour q and the price range), so the counts show
+    what picking another bucket would return. They are cached per catalog version.
     """
+    min_price = _parse_price(min_price)
+    max_price = _parse_price(max_price)
     conn = get_db_connection()
-    query = 'SELECT * FROM products'
-    clauses = []
-    params = []
-    if q:
-        clauses.append('name LIKE ?')
-        params.append(f'%{q}%')
-    if min_price is not None:
-        try:
-            clauses.append('price >= ?')
-            params.append(float(min_price))
-        except (ValueError, TypeError):
-            pass
-    if max_price is not None:
-        try:
-            clauses.append('price <= ?')
-            params.append(float(max_price))
-        except (ValueError, TypeError):
-            pass
-    if has_image is True:
-        clauses.append("image IS NOT NULL AND image != ''")
+    try:
+        if facets:
+            # One read snapshot, so the cached facets match the version they are stored under
+            conn.execute('BEGIN')
+        text_clauses, text_params = [], []
+        if q:
+            text_clauses.append('name LIKE ?')
+            text_params.append(f'%{q}%')
+        price_clauses, price_params = [], []
+        if min_price is not None:
+            price_clauses.append('price >= ?')
+            price_params.append(min_price)
+        if max_price is not None:
+            price_clauses.append('price <= ?')
+            price_params.append(max_price)
+        image_clauses = ["image IS NOT NULL AND image != ''"] if has_image is True else []
+
+        clauses = text_clauses + price_clauses + image_clauses
+        query = f'SELECT {Product.COLUMNS} FROM products'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY id'
+        rows = _fetch_records(conn, Product, query, text_params + price_params)
+        if not facets:
+            return rows
+
+        bounds = tuple(sorted(price_buckets) if price_buckets else PRICE_BUCKETS)
+        version_row = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+        cache_key = (version_row[0] if version_row else 0, q or None, min_price, max_price, has_image is True, bounds)
+        counts = _facet_cache_get(cache_key)
+        if counts is None:
+            counts = _count_facets(conn, text_clauses, text_params, price_clauses, price_params,
+                                   image_clauses, bounds)
+            _facet_cache_put(cache_key, counts)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    bucket_counts, with_image, without_image = counts
+    return rows, {
+        'price': [{'min': low, 'max': bounds[i + 1] if i + 1 < len(bounds) else None, 'count': bucket_counts[i]}
+                  for i, low in enumerate(bounds)],
+        'image': {'with': with_image, 'without': without_image},
+        'total': len(rows),
+    }
+
+
+def _count_facets(conn, text_clauses, text_params, price_clauses, price_params, image_clauses, bounds):
+    """Bucket and image counts in a single pass over the q-filtered products."""
+    has_image_sql = "(image IS NOT NULL AND image != '')"
+    price_sql = ' AND '.join(price_clauses) or '1'
+    bucket_filter = ' AND '.join(image_clauses) or '1'
+    columns, params = [], []
+    for i, low in enumerate(bounds):
+        if i + 1 < len(bounds):
+            columns.append(f'SUM(CASE WHEN {bucket_filter} AND price >= ? AND price < ? THEN 1 ELSE 0 END)')
+            params += [low, bounds[i + 1]]
+        else:
+            columns.append(f'SUM(CASE WHEN {bucket_filter} AND price >= ? THEN 1 ELSE 0 END)')
+            params.append(low)
+    columns.append(f'SUM(CASE WHEN {price_sql} AND {has_image_sql} THEN 1 ELSE 0 END)')
+    columns.append(f'SUM(CASE WHEN {price_sql} AND NOT {has_image_sql} THEN 1 ELSE 0 END)')
+    params += price_params * 2
+    query = f'SELECT {", ".join(columns)} FROM products'
+    if text_clauses:
+        query += ' WHERE ' + ' AND '.join(text_clauses)
+    row = [value or 0 for value in conn.execute(query, params + text_params).fetchone()]
+    return row[:len(bounds)], row[-2], row[-1]
+
+
+def _facet_cache_get(key):
+    with _facet_cache_lock:
+        counts = _facet_cache.get(key)
+        if counts is not None:
+            _facet_cache.move_to_end(key)
+        return counts
+
+
+def _facet_cache_put(key, counts):
+    with _facet_cache_lock:
+        _facet_cache[key] = counts
+        # Entries of older catalog versions are never hit again and age out first
+        while len(_facet_cache) > FACET_CACHE_SIZE:
+            _facet_cache.popitem(last=False)
 
-    if clauses:
-        query += ' WHERE ' + ' AND '.join(clauses)
-    query += ' ORDER BY id'
-    products = conn.execute(query, params).fetchall()
+
+def get_catalog_version():
+    conn = get_db_connection()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
     conn.close()
-    return products
+    return row[0] if row else 0
+
+
+def _bump_catalog_version(conn):
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'catalog_version'")
 
 
 def get_product(product_id):
     conn = get_db_connection()
-    product = conn.execute('SELECT * FROM products WHERE id = ?', (product_id,)).fetchone()
+    product = _fetch_record(conn, Product, f'SELECT {Product.COLUMNS} FROM products WHERE id = ?', (product_id,))
     conn.close()
     return product
 
@@ -76,66 +256,274 @@ def add_product(name, price, image=''):
     cur = conn.cursor()
     cur.execute('INSERT INTO products (name, price, image) VALUES (?, ?, ?)',
                 (name, price, image))
+    product_id = cur.lastrowid
+    _bump_catalog_version(conn)
     conn.commit()
     conn.close()
+    return product_id
 
 
 def update_product(product_id, name, price, image=''):
+    """Update a product; returns False if there is no product with this id."""
+    conn = get_db_connection()
+    cur = conn.execute('UPDATE products SET name = ?, price = ?, image = ? WHERE id = ?',
+                       (name, price, image, product_id))
+    updated = cur.rowcount == 1
+    if updated:
+        _bump_catalog_version(conn)
+    conn.commit()
+    conn.close()
+    return updated
+
+
+def set_product_image(product_id, image):
     conn = get_db_connection()
-    conn.execute('UPDATE products SET name = ?, price = ?, image = ? WHERE id = ?',
-                 (name, price, image, product_id))
+    conn.execute('UPDATE products SET image = ? WHERE id = ?', (image, product_id))
+    _bump_catalog_version(conn)
     conn.commit()
     conn.close()
 
 
+def image_in_use(image):
+    """True if any product still points at this image URL."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT 1 FROM products WHERE image = ? LIMIT 1', (image,)).fetchone()
+    conn.close()
+    return row is not None
+
+
 def delete_product(product_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM products WHERE id = ?', (product_id,))
+    _bump_catalog_version(conn)
     conn.commit()
     conn.close()
 
-def add_order(email, address, cart, phone=''):
-    try:
+def _to_money(value):
+    return Decimal(str(value)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def get_products_by_ids(product_ids, conn=None):
+    """Return {id: product row} for the given ids using a single IN (...) query."""
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+    own_conn = conn is None
+    if own_conn:
         conn = get_db_connection()
-        total_price = sum(item['price'] * item['quantity'] for item in cart.values())
+    placeholders = ', '.join('?' for _ in ids)
+    rows = _fetch_records(conn, Product, f'SELECT {Product.COLUMNS} FROM products WHERE id IN ({placeholders})', ids)
+    if own_conn:
+        conn.close()
+    return {row.id: row for row in rows}
+
+
+def price_cart(cart, conn=None):
+    """Price a cart against the catalog, ignoring any client-supplied prices.
+    - cart: {key: {'id': product_id, 'quantity': n, ...}} as stored in the session
+      or sent to POST /api/v1/orders; 'id' falls back to the key
+    Returns {'items': [...], 'total': float} with names and prices taken from products
+    and line/order totals rounded half-up to cents. Raises CartError for an empty cart,
+    a non-positive quantity or a product that does not exist (or was deleted).
+    """
+    if not cart:
+        raise CartError('Cart is empty')
+    if not isinstance(cart, dict):
+        raise CartError('Cart must be an object of {product_id: {"id": ..., "quantity": ...}}')
+    lines = []
+    for key, item in cart.items():
+        try:
+            product_id = int(item.get('id', key))
+            quantity = int(item.get('quantity', 1))
+        except (AttributeError, TypeError, ValueError):
+            raise CartError(f'Invalid cart item: {key}')
+        if quantity <= 0:
+            raise CartError(f'Invalid quantity for product {product_id}')
+        lines.append((product_id, quantity))
+
+    products = get_products_by_ids([product_id for product_id, _ in lines], conn)
+    items = []
+    total = Decimal('0')
+    for product_id, quantity in lines:
+        product = products.get(product_id)
+        if product is None:
+            raise CartError(f'Product {product_id} not found')
+        try:
+            unit_price = _to_money(product.price)
+        except InvalidOperation:
+            raise CartError(f'Product {product_id} has no valid price')
+        line_total = (unit_price * quantity).quantize(CENTS, rounding=ROUND_HALF_UP)
+        total += line_total
+        items.append({
+            'id': product_id,
+            'name': product.name,
+            'price': float(unit_price),
+            'quantity': quantity,
+            'line_total': float(line_total),
+        })
+    return {'items': items, 'total': float(total)}
+
+
+def add_order(email, address, cart, phone='', idempotency_key=None):
+    """Create an order priced from the catalog and return its id.
+    - idempotency_key: (scope, key) claimed by the request; marked 'committed' with the
+      order id in the same transaction, so a retry can never create the order again
+    """
+    conn = get_db_connection()
+    try:
+        # Prices always come from the catalog, never from the cart contents
+        priced = price_cart(cart, conn)
         cur = conn.cursor()
         cur.execute('INSERT INTO orders (email, address, total_price, status, date, phone) VALUES (?, ?, ?, ?, ?, ?)',
-                    (email, address, total_price, 'Нове', datetime.now().strftime("%Y-%m-%d %H:%M:%S"), phone))
+                    (email, address, priced['total'], 'Нове', datetime.now().strftime("%Y-%m-%d %H:%M:%S"), phone))
         order_id = cur.lastrowid
-        for item in cart.values():
-            cur.execute('INSERT INTO order_items (order_id, product_id, quantity) VALUES (?, ?, ?)',
-                        (order_id, item['id'], item['quantity']))
+        cur.executemany('INSERT INTO order_items (order_id, product_id, quantity, unit_price, product_name, line_total) VALUES (?, ?, ?, ?, ?, ?)',
+                        [(order_id, item['id'], item['quantity'], item['price'], item['name'], item['line_total'])
+                         for item in priced['items']])
+        _log_change(conn, 'order', order_id, 'created',
+                    {'email': email, 'total_price': priced['total'], 'status': 'Нове'})
+        if idempotency_key:
+            conn.execute("UPDATE idempotency_keys SET status = 'committed', result_id = ? WHERE scope = ? AND key = ?",
+                         (order_id,) + tuple(idempotency_key))
         conn.commit()
-        conn.close()
-        return order_id
     except sqlite3.OperationalError as e:
-        print(f'Database error in add_order: {e}')
+        logger.error('Database error in add_order: %s', e)
         raise
+    finally:
+        # Closing an uncommitted connection rolls it back and releases its locks
+        conn.close()
+    _notify_changes()
+    return order_id
 
 def get_orders():
     conn = get_db_connection()
-    orders = conn.execute('SELECT * FROM orders').fetchall()
+    orders = _fetch_records(conn, Order, f'SELECT {Order.COLUMNS} FROM orders')
     conn.close()
     return orders
 
 
 def get_orders_by_email(email):
     conn = get_db_connection()
-    orders = conn.execute('SELECT * FROM orders WHERE email = ? ORDER BY date DESC', (email,)).fetchall()
+    orders = _fetch_records(conn, Order, f'SELECT {Order.COLUMNS} FROM orders WHERE email = ? ORDER BY date DESC', (email,))
     conn.close()
     return orders
 
 
 def get_clients():
     conn = get_db_connection()
-    clients = conn.execute('SELECT * FROM clients').fetchall()
+    clients = _fetch_records(conn, Client, f'SELECT {Client.COLUMNS} FROM clients')
     conn.close()
     return clients
 
 
+def _normalize_phone(phone):
+    return ''.join(ch for ch in (phone or '') if ch.isdigit())
+
+
+def _client_search_keys(name, email, phone):
+    return ((name or '').strip().lower(), (email or '').strip().lower(), _normalize_phone(phone))
+
+
+# Prefix search scans these indexes one after another, each in (key, id) order
+CLIENT_SEARCH_COLUMNS = ('name_lower', 'email_lower', 'phone_normalized')
+_PREFIX_END = '\U0010ffff'
+
+
+def _parse_client_cursor(after, sources):
+    """'<source>:<id>:<key>' from a previous page, or None to start from the beginning."""
+    try:
+        source, last_id, key = str(after).split(':', 2)
+        source, last_id = int(source), int(last_id)
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= source < len(sources):
+        return None
+    return source, last_id, key
+
+
+def search_clients(q=None, after=None, limit=50):
+    """Search clients by prefix of name, email or phone with keyset pagination.
+    - q: prefix; matched case-insensitively against name and email, and by digits against phone
+    - after: the previous page's next_after cursor
+    - limit: page size
+    Without q clients are listed by id. With q, name matches come first (ordered by name),
+    then email matches, then phone matches, and a client is listed only under the first key
+    it matches. Every page is a bounded range scan of one or more of the key indexes,
+    resumed from the cursor, so its cost depends on the page size, not the number of matches.
+    Returns (clients, next_after) where clients are dicts with order_count and
+    last_order_date added from a single grouped query over orders.
+    """
+    conn = get_db_connection()
+    columns = 'id, name, email, phone, address, has_courses'
+    term = (q or '').strip().lower()
+    next_after = None
+    if not term:
+        try:
+            after_id = int(after) if after not in (None, '') else 0
+        except ValueError:
+            after_id = 0
+        # Fetch one extra row to know whether there is a next page
+        rows = conn.execute(f'SELECT {columns} FROM clients WHERE id > ? ORDER BY id LIMIT ?',
+                            (after_id, limit + 1)).fetchall()
+        if len(rows) > limit:
+            next_after = str(rows[limit - 1]['id'])
+        clients = [dict(row) for row in rows[:limit]]
+    else:
+        sources = [('name_lower', term), ('email_lower', term)]
+        digits = _normalize_phone(term)
+        if digits:
+            sources.append(('phone_normalized', digits))
+        cursor = _parse_client_cursor(after, sources)
+        first = cursor[0] if cursor else 0
+        found = []
+        for i in range(first, len(sources)):
+            column, prefix = sources[i]
+            # Range comparisons instead of LIKE so the BINARY index on the column is used
+            clauses = [f'{column} >= ?', f'{column} < ?']
+            params = [prefix, prefix + _PREFIX_END]
+            if cursor and i == first:
+                _, last_id, last_key = cursor
+                params[0] = max(prefix, last_key)
+                clauses.append(f'({column} > ? OR id > ?)')
+                params += [last_key, last_id]
+            # Clients matching an earlier key were already listed under it
+            for earlier_column, earlier_prefix in sources[:i]:
+                clauses.append(f"NOT (IFNULL({earlier_column}, '') >= ? AND IFNULL({earlier_column}, '') < ?)")
+                params += [earlier_prefix, earlier_prefix + _PREFIX_END]
+            params.append(limit + 1 - len(found))
+            rows = conn.execute(f'SELECT {columns}, {column} AS sort_key FROM clients WHERE {" AND ".join(clauses)} '
+                                f'ORDER BY {column}, id LIMIT ?', params).fetchall()
+            found += [(i, row) for row in rows]
+            if len(found) > limit:
+                break
+        if len(found) > limit:
+            i, row = found[limit - 1]
+            next_after = f'{i}:{row["id"]}:{row["sort_key"]}'
+        clients = []
+        for _, row in found[:limit]:
+            client = dict(row)
+            del client['sort_key']
+            clients.append(client)
+
+    emails = sorted({c['email'] for c in clients if c['email']})
+    stats = {}
+    if emails:
+        placeholders = ', '.join('?' for _ in emails)
+        stats = {row['email']: row for row in conn.execute(
+            f'SELECT email, COUNT(*) AS order_count, MAX(date) AS last_order_date FROM orders '
+            f'WHERE email IN ({placeholders}) GROUP BY email', emails)}
+    conn.close()
+
+    for client in clients:
+        row = stats.get(client['email'])
+        client['order_count'] = row['order_count'] if row else 0
+        client['last_order_date'] = row['last_order_date'] if row else None
+    return clients, next_after
+
+
 def get_client(client_id):
     conn = get_db_connection()
-    client = conn.execute('SELECT * FROM clients WHERE id = ?', (client_id,)).fetchone()
+    client = _fetch_record(conn, Client, f'SELECT {Client.COLUMNS} FROM clients WHERE id = ?', (client_id,))
     conn.close()
     return client
 
@@ -143,16 +531,16 @@ def get_client(client_id):
 def add_client(name, email, phone, address, has_courses=0):
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute('INSERT INTO clients (name, email, phone, address, has_courses) VALUES (?, ?, ?, ?, ?)',
-                (name, email, phone, address, 1 if has_courses else 0))
+    cur.execute('INSERT INTO clients (name, email, phone, address, has_courses, name_lower, email_lower, phone_normalized) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, email, phone, address, 1 if has_courses else 0) + _client_search_keys(name, email, phone))
     conn.commit()
     conn.close()
 
 
 def update_client(client_id, name, email, phone, address, has_courses=0):
     conn = get_db_connection()
-    conn.execute('UPDATE clients SET name = ?, email = ?, phone = ?, address = ?, has_courses = ? WHERE id = ?',
-                 (name, email, phone, address, 1 if has_courses else 0, client_id))
+    conn.execute('UPDATE clients SET name = ?, email = ?, phone = ?, address = ?, has_courses = ?, name_lower = ?, email_lower = ?, phone_normalized = ? WHERE id = ?',
+                 (name, email, phone, address, 1 if has_courses else 0) + _client_search_keys(name, email, phone) + (client_id,))
     conn.commit()
     conn.close()
 
@@ -165,8 +553,9 @@ def delete_client(client_id):
 
 def get_order_details(order_id):
     conn = get_db_connection()
-    order = conn.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
-    items = conn.execute('SELECT oi.quantity, p.name, p.price FROM order_items oi JOIN products p ON oi.product_id = p.id WHERE oi.order_id = ?', (order_id,)).fetchall()
+    order = _fetch_record(conn, Order, f'SELECT {Order.COLUMNS} FROM orders WHERE id = ?', (order_id,))
+    # Line items are read from the checkout snapshot only, no JOIN with products
+    items = _fetch_records(conn, OrderItem, 'SELECT product_id, quantity, product_name AS name, unit_price AS price, line_total FROM order_items WHERE order_id = ? ORDER BY id', (order_id,))
     conn.close()
     return order, items
 
@@ -179,13 +568,172 @@ def update_order_contact(order_id, address, phone):
 
 def update_order_status(order_id, status):
     conn = get_db_connection()
-    conn.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+    cur = conn.execute('UPDATE orders SET status = ? WHERE id = ?', (status, order_id))
+    if cur.rowcount:
+        _log_change(conn, 'order', order_id, 'status_changed', {'status': status})
     conn.commit()
     conn.close()
+    _notify_changes()
 
 def delete_order(order_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM order_items WHERE order_id = ?', (order_id,))
-    conn.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+    cur = conn.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+    if cur.rowcount:
+        _log_change(conn, 'order', order_id, 'deleted')
+    conn.commit()
+    conn.close()
+    _notify_changes()
+
+
+def get_feedback():
+    conn = get_db_connection()
+    feedback = _fetch_records(conn, Feedback, f'SELECT {Feedback.COLUMNS} FROM feedback ORDER BY id DESC')
+    conn.close()
+    return feedback
+
+
+def add_feedback(name, email, message):
+    conn = get_db_connection()
+    cur = conn.execute('INSERT INTO feedback (name, email, message) VALUES (?, ?, ?)', (name, email, message))
+    feedback_id = cur.lastrowid
+    _log_change(conn, 'feedback', feedback_id, 'created', {'name': name, 'email': email})
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
+    _notify_changes()
+    return feedback_id
+
+
+def _log_change(conn, entity, entity_id, action, payload=None):
+    """Append a change log entry in the caller's transaction; compacts old entries now and then."""
+    now = time.time()
+    cur = conn.execute('INSERT INTO change_log (entity, entity_id, action, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+                       (entity, entity_id, action, json.dumps(payload, ensure_ascii=False) if payload else None, now))
+    if cur.lastrowid % CHANGE_LOG_COMPACT_EVERY == 0:
+        conn.execute('DELETE FROM change_log WHERE created_at < ?', (now - CHANGE_LOG_RETENTION,))
+
+
+def _notify_changes():
+    with _change_cond:
+        _change_cond.notify_all()
+
+
+def get_changes(since=0, limit=500):
+    """Return (changes, reset) for change log entries with seq > since, oldest first.
+    reset is True when entries after `since` were already compacted away and the
+    consumer has to re-read the full state before following the feed again.
+    """
+    conn = get_db_connection()
+    rows = conn.execute('SELECT * FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?', (since, limit)).fetchall()
+    reset = False
+    if since:
+        oldest = conn.execute('SELECT MIN(seq) FROM change_log').fetchone()[0]
+        reset = oldest is not None and oldest > since + 1
+    conn.close()
+    changes = [{
+        'seq': row['seq'],
+        'entity': row['entity'],
+        'entity_id': row['entity_id'],
+        'action': row['action'],
+        'data': json.loads(row['payload']) if row['payload'] else {},
+        'created_at': row['created_at'],
+    } for row in rows]
+    return changes, reset
+
+
+def get_latest_change_seq():
+    conn = get_db_connection()
+    seq = conn.execute('SELECT MAX(seq) FROM change_log').fetchone()[0]
+    conn.close()
+    return seq or 0
+
+
+def wait_for_changes(since=0, timeout=25.0, limit=500):
+    """Long-poll variant of get_changes: block up to `timeout` seconds until there is
+    something after `since`. Writes in this process wake waiters immediately; the
+    periodic re-check also picks up writes from other processes."""
+    deadline = time.monotonic() + timeout
+    while True:
+        changes, reset = get_changes(since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or reset or remaining <= 0:
+            return changes, reset
+        with _change_cond:
+            _change_cond.wait(min(remaining, 1.0))
+
+
+def claim_idempotency_key(scope, key, fingerprint, ttl, pending_timeout):
+    """Try to become the request that executes (scope, key).
+    Returns (True, None) if the key was claimed, otherwise (False, row) with the
+    stored entry: 'pending' while the first request is still running, 'committed'
+    (with result_id) once its order is saved, 'done' with a stored response otherwise.
+    Expired entries, and pending ones abandoned for longer than pending_timeout
+    seconds, are evicted first; committed keys are only evicted by the TTL.
+    """
+    now = time.time()
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM idempotency_keys WHERE expires_at < ?', (now,))
+        conn.execute("DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status = 'pending' AND created_at < ?",
+                     (scope, key, now - pending_timeout))
+        cur = conn.execute("INSERT OR IGNORE INTO idempotency_keys (key, scope, fingerprint, status, created_at, expires_at) VALUES (?, ?, ?, 'pending', ?, ?)",
+                           (key, scope, fingerprint, now, now + ttl))
+        conn.commit()
+        claimed = cur.rowcount == 1
+        row = None
+        if not claimed:
+            row = conn.execute('SELECT * FROM idempotency_keys WHERE scope = ? AND key = ?', (scope, key)).fetchone()
+    finally:
+        conn.close()
+    return claimed, row
+
+
+def get_idempotency_key(scope, key):
+    conn = get_db_connection()
+    try:
+        return conn.execute('SELECT * FROM idempotency_keys WHERE scope = ? AND key = ?', (scope, key)).fetchone()
+    finally:
+        conn.close()
+
+
+def complete_idempotency_key(scope, key, response_status, response_headers, response_body):
+    conn = get_db_connection()
+    try:
+        conn.execute("UPDATE idempotency_keys SET status = 'done', response_status = ?, response_headers = ?, response_body = ? WHERE scope = ? AND key = ? AND status = 'pending'",
+                     (response_status, response_headers, response_body, scope, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def release_idempotency_key(scope, key):
+    conn = get_db_connection()
+    try:
+        conn.execute("DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status = 'pending'", (scope, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def record_maintenance_run(task, ok, started_at, finished_at, duration, result=None, error=None):
+    conn = get_db_connection()
+    try:
+        conn.execute('INSERT OR REPLACE INTO maintenance_runs (task, ok, started_at, finished_at, duration, result, error) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (task, int(ok), started_at, finished_at, duration,
+                      json.dumps(result, ensure_ascii=False) if result is not None else None, error))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_maintenance_runs():
+    """Last recorded run of every maintenance task, by task name."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('SELECT * FROM maintenance_runs ORDER BY task').fetchall()
+    finally:
+        conn.close()
+    return {row['task']: {'ok': bool(row['ok']), 'started_at': row['started_at'], 'finished_at': row['finished_at'],
+                          'duration': row['duration'], 'result': json.loads(row['result']) if row['result'] else None,
+                          'error': row['error']}
+            for row in rows}
@@ -0,0 +1,129 @@
+"""Typed, compact row objects for the models layer.
+
+Each record keeps the column tuple sqlite3 hands us (one __slots__ field, no per-row
+dict) and exposes the columns both as attributes (product.name) and by key
+(product['name']), so templates and older code written against sqlite3.Row keep
+working. Lists of records are encoded to JSON straight from those tuples, with the
+'"key":' fragments precomputed once per class.
+"""
+from json import dumps
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+
+
+def _encode_value(value):
+    return dumps(value)
+
+
+# Column values from SQLite are only ever str / int / float / None (bytes aside)
+_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: float.__repr__,
+    type(None): lambda value: 'null',
+}
+
+
+class Record:
+    __slots__ = ('_values',)
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls.FIELDS)}
+        for i, name in enumerate(cls.FIELDS):
+            setattr(cls, name, property(itemgetter(i)))
+        cls._json_keys = tuple(('{' if i == 0 else ',') + encode_basestring_ascii(name) + ':'
+                               for i, name in enumerate(cls.FIELDS))
+        cls.COLUMNS = ', '.join(cls.FIELDS)
+
+    def __init__(self, values):
+        self._values = tuple(values)
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        record = cls.__new__(cls)
+        record._values = row
+        return record
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def keys(self):
+        return self.FIELDS
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other._values == self._values
+
+    def __hash__(self):
+        return hash(self._values)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(f"{k}={v!r}" for k, v in zip(self.FIELDS, self._values))})'
+
+    def to_dict(self):
+        return dict(zip(self.FIELDS, self._values))
+
+    def to_json(self):
+        parts = []
+        append = parts.append
+        for key, value in zip(self._json_keys, self._values):
+            append(key)
+            append(_ENCODERS.get(type(value), _encode_value)(value))
+        append('}' if parts else '{}')
+        return ''.join(parts)
+
+
+def encode_records(records):
+    """JSON array for a list of records, without building intermediate dicts."""
+    if not records:
+        return '[]'
+    parts = ['[']
+    append = parts.append
+    encoders = _ENCODERS
+    for n, record in enumerate(records):
+        if n:
+            append(',')
+        for key, value in zip(record._json_keys, record._values):
+            append(key)
+            append(encoders.get(type(value), _encode_value)(value))
+        append('}' if record._values else '{}')
+    append(']')
+    return ''.join(parts)
+
+
+class Product(Record):
+    __slots__ = ()
+    FIELDS = ('id', 'name', 'price', 'image')
+
+
+class Order(Record):
+    __slots__ = ()
+    FIELDS = ('id', 'email', 'address', 'total_price', 'status', 'date', 'phone')
+
+
+class OrderItem(Record):
+    __slots__ = ()
+    FIELDS = ('product_id', 'quantity', 'name', 'price', 'line_total')
+
+
+class Client(Record):
+    __slots__ = ()
+    FIELDS = ('id', 'name', 'email', 'phone', 'address', 'has_courses')
+
+
+class Feedback(Record):
+    __slots__ = ()
+    FIELDS = ('id', 'name', 'email', 'message')
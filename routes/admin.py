@@ -1,10 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, request, session, flash, current_app
-from models import get_db_connection, get_orders, get_order_details, update_order_status, delete_order
-from models import get_clients, add_client, update_client, delete_client
-from models import get_products, get_product, add_product, update_product, delete_product
+from flask import Blueprint, render_template, redirect, url_for, request, session, flash, current_app, jsonify
+from models import get_db_connection, get_orders, get_order_details, update_order_status, delete_order, get_latest_change_seq, get_feedback
+from models import search_clients, add_client, update_client, delete_client
+from models import get_products, get_product, add_product, update_product, delete_product, set_product_image, image_in_use
+from werkzeug.exceptions import RequestEntityTooLarge
+from media import store_image, delete_image, MediaError
+from suggest import product_index
 
 admin_bp = Blueprint('admin', __name__)
 
+CLIENTS_PAGE_SIZE = 50
+
 
 # Перед доступом до захищених маршрутів перевіряємо, чи увійшов адмін
 @admin_bp.before_request
@@ -36,15 +41,31 @@ def logout():
     flash('Ви вийшли з адмін-панелі', 'info')
     return redirect(url_for('admin.login'))
 
+
 @admin_bp.route('/admin')
 def admin():
-    conn = get_db_connection()
-    feedback = conn.execute('SELECT * FROM feedback').fetchall()
-    conn.close()
+    # Read the change feed position first, so nothing written while rendering is missed
+    changes_since = get_latest_change_seq()
+    feedback = get_feedback()
     orders = get_orders()
-    clients = get_clients()
+    client_q = request.args.get('client_q', '').strip()
+    clients, clients_next = search_clients(q=client_q or None, after=request.args.get('client_after'),
+                                           limit=CLIENTS_PAGE_SIZE)
     products = get_products()
-    return render_template('admin.html', feedback=feedback, orders=orders, clients=clients, products=products)
+    return render_template('admin.html', feedback=feedback, orders=orders, clients=clients, products=products,
+                           client_q=client_q, clients_next=clients_next, changes_since=changes_since)
+
+
+@admin_bp.route('/admin/clients/search')
+def search_clients_route():
+    # JSON пошук клієнтів за префіксом імені/email/телефону з keyset-пагінацією (?q=&after=&limit=)
+    try:
+        limit = min(max(int(request.args.get('limit', CLIENTS_PAGE_SIZE)), 1), 200)
+    except ValueError:
+        limit = CLIENTS_PAGE_SIZE
+    clients, next_after = search_clients(q=request.args.get('q'), after=request.args.get('after'), limit=limit)
+    return jsonify({'clients': clients, 'next_after': next_after})
+
 
 @admin_bp.route('/admin/delete_feedback/<int:id>', methods=['POST'])
 def delete_feedback(id):
@@ -112,7 +133,8 @@ def add_product_route():
     try:
         price = float(price)
         if name and price > 0:
-            add_product(name, price, image)
+            product_id = add_product(name, price, image)
+            product_index.upsert(product_id, name, price, image)
             flash('Товар додано', 'info')
     except ValueError:
         flash('Неправильна ціна', 'error')
@@ -127,8 +149,11 @@ def edit_product_route(product_id):
     try:
         price = float(price)
         if name and price > 0:
-            update_product(product_id, name, price, image)
-            flash('Товар оновлено', 'info')
+            if update_product(product_id, name, price, image):
+                product_index.upsert(product_id, name, price, image)
+                flash('Товар оновлено', 'info')
+            else:
+                flash('Товар не знайдено', 'error')
     except ValueError:
         flash('Неправильна ціна', 'error')
     return redirect(url_for('admin.admin'))
@@ -137,5 +162,26 @@ def edit_product_route(product_id):
 @admin_bp.route('/admin/products/delete/<int:product_id>', methods=['POST'])
 def delete_product_route(product_id):
     delete_product(product_id)
+    product_index.remove(product_id)
     flash('Товар видалено', 'info')
-    return redirect(url_for('admin.admin'))
\ No newline at end of file
+    return redirect(url_for('admin.admin'))
+
+
+@admin_bp.route('/admin/products/<int:product_id>/image', methods=['POST'])
+def upload_product_image_route(product_id):
+    product = get_product(product_id)
+    if not product:
+        flash('Товар не знайдено', 'error')
+        return redirect(url_for('admin.admin'))
+    try:
+        stored = store_image(request.files.get('image'))
+    except (MediaError, RequestEntityTooLarge):
+        flash('Завантажте зображення PNG, JPEG, GIF або WebP (до 5 МБ)', 'error')
+        return redirect(url_for('admin.admin'))
+    set_product_image(product_id, stored['url'])
+    product_index.upsert(product_id, product['name'], product['price'], stored['url'])
+    # The replaced upload is removed once no product uses it anymore
+    if product['image'] != stored['url'] and not image_in_use(product['image']):
+        delete_image(product['image'])
+    flash('Зображення товару оновлено', 'info')
+    return redirect(url_for('admin.admin'))
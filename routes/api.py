@@ -1,14 +1,34 @@
-from flask import Blueprint, jsonify, request
+import hashlib
+import hmac
+import json
+import time
+from flask import Blueprint, Response, jsonify, request, current_app, session, g
 from functools import wraps
+from werkzeug.exceptions import RequestEntityTooLarge
+from media import store_image, delete_image, media_url, MediaError
+from idempotency import idempotent
+from admission import hold_admission_slot
+from maintenance import get_status as get_maintenance_status
+from suggest import product_index
+from records import encode_records
 from models import (
     get_db_connection,
     get_products,
+    get_product,
+    get_catalog_version,
+    set_product_image,
+    image_in_use,
     get_orders,
     get_orders_by_email,
     get_order_details,
     add_order,
+    CartError,
     update_order_status,
-    delete_order
+    delete_order,
+    add_feedback,
+    get_feedback,
+    get_changes,
+    wait_for_changes
 )
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
@@ -39,6 +59,20 @@ def require_json(*required_fields):
         return wrapper
     return decorator
 
+def require_admin(f):
+    """Allow the request only for a logged-in admin session or a matching
+    'Authorization: Bearer <ADMIN_API_TOKEN>' header (token auth is off while the token is unset)."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if session.get('admin_logged_in'):
+            return f(*args, **kwargs)
+        token = current_app.config.get('ADMIN_API_TOKEN')
+        auth = request.headers.get('Authorization', '')
+        if token and auth.startswith('Bearer ') and hmac.compare_digest(auth[len('Bearer '):].encode(), token.encode()):
+            return f(*args, **kwargs)
+        return error_response('Admin authentication required', 'UNAUTHORIZED', 401)
+    return wrapper
+
 def error_response(message, code, status_code=500, details=None):
     """Create a standardized error response."""
     response = {'error': message, 'code': code, 'status': status_code}
@@ -54,6 +88,11 @@ def success_response(data, message=None, status_code=200):
     response['data'] = data
     return jsonify(response), status_code
 
+def raw_success_response(data_json, status_code=200):
+    """Standardized success response whose data is already encoded JSON (e.g. encode_records output)."""
+    body = f'{{"data":{data_json},"status":"success","status_code":{status_code}}}'
+    return current_app.response_class(body, status=status_code, mimetype='application/json')
+
 # Products endpoints
 @api_bp.route('/products', methods=['GET'])
 def get_all_products():
@@ -83,23 +122,155 @@ def get_all_products():
         type: boolean
         required: false
         description: Тільки товари з фото
+      - name: facets
+        in: query
+        type: boolean
+        required: false
+        description: Додати кількість товарів за ціновими діапазонами та з/без фото
+      - name: buckets
+        in: query
+        type: string
+        required: false
+        description: Нижні межі цінових діапазонів через кому, напр. 0,500,1000
     responses:
       200:
-        description: Список продуктів
+        description: Список продуктів (з facets — об'єкт products + facets)
+      304:
+        description: Каталог не змінився з часу запиту з цим ETag
       500:
         description: Помилка сервера
     """
     try:
+        # The result only depends on the query and the catalog version, so clients can revalidate cheaply
+        etag = f'catalog-{get_catalog_version()}-{hashlib.sha1(request.query_string).hexdigest()[:16]}'
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
         q = request.args.get('q')
         min_price = request.args.get('min_price')
         max_price = request.args.get('max_price')
         has_image = request.args.get('has_image') in ('true', '1', 'yes') if request.args.get('has_image') else None
-        
-        products = get_products(q=q, min_price=min_price, max_price=max_price, has_image=has_image)
-        return success_response([dict(product) for product in products])
+        with_facets = request.args.get('facets') in ('true', '1', 'yes')
+
+        if with_facets:
+            try:
+                buckets = [float(b) for b in request.args.get('buckets', '').split(',') if b.strip()] or None
+            except ValueError:
+                return error_response('buckets must be a comma-separated list of numbers', 'INVALID_BUCKETS', 400)
+            products, facets = get_products(q=q, min_price=min_price, max_price=max_price, has_image=has_image,
+                                            facets=True, price_buckets=buckets)
+            data_json = f'{{"facets":{json.dumps(facets)},"products":{encode_records(products)}}}'
+        else:
+            products = get_products(q=q, min_price=min_price, max_price=max_price, has_image=has_image)
+            data_json = encode_records(products)
+        response = raw_success_response(data_json)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return error_response(f'Error retrieving products: {str(e)}', 'PRODUCT_RETRIEVAL_ERROR', 500)
 
+@api_bp.route('/products/suggest', methods=['GET'])
+def suggest_products():
+    """
+    Підказки назв товарів під час введення (search-as-you-type)
+    ---
+    tags:
+      - Products
+    parameters:
+      - name: prefix
+        in: query
+        type: string
+        required: true
+        description: Початок назви товару або будь-якого слова в ній
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Кількість підказок (1-50, за замовчуванням 10)
+    responses:
+      200:
+        description: Список підказок
+      500:
+        description: Помилка сервера
+    """
+    try:
+        started = time.perf_counter()
+        try:
+            limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        suggestions = product_index.suggest(request.args.get('prefix', ''), limit)
+        response, status_code = success_response(suggestions)
+        response.headers['Server-Timing'] = f'suggest;dur={(time.perf_counter() - started) * 1000:.3f}'
+        return response, status_code
+    except Exception as e:
+        return error_response(str(e), 'SUGGEST_ERROR', 500)
+
+@api_bp.route('/products/<int:product_id>/image', methods=['POST'])
+@require_admin
+def upload_product_image(product_id):
+    """
+    Завантажити зображення товару
+    ---
+    tags:
+      - Products
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: false
+        description: "Bearer <ADMIN_API_TOKEN>, якщо немає сесії адміністратора"
+      - name: product_id
+        in: path
+        type: integer
+        required: true
+        description: ID товару
+      - name: image
+        in: formData
+        type: file
+        required: true
+        description: PNG, JPEG, GIF або WebP (до 5 МБ)
+    responses:
+      201:
+        description: Зображення збережено, URL записано в товар
+      400:
+        description: Файл відсутній або не є підтримуваним зображенням
+      401:
+        description: Потрібна авторизація адміністратора
+      404:
+        description: Товар не знайдено
+      413:
+        description: Тіло запиту більше за MAX_CONTENT_LENGTH
+      500:
+        description: Помилка сервера
+    """
+    try:
+        product = get_product(product_id)
+        if not product:
+            return error_response('Product not found', 'PRODUCT_NOT_FOUND', 404)
+        stored = store_image(request.files.get('image'))
+        set_product_image(product_id, stored['url'])
+        product_index.upsert(product_id, product['name'], product['price'], stored['url'])
+        if product['image'] != stored['url'] and not image_in_use(product['image']):
+            delete_image(product['image'])
+        return success_response({
+            'product_id': product_id,
+            'image': stored['url'],
+            'hash': stored['hash'],
+            'variants': [media_url(name) for name in stored['variants']]
+        }, status_code=201)
+    except MediaError as e:
+        return error_response(str(e), 'INVALID_IMAGE', 400)
+    except RequestEntityTooLarge:
+        return error_response('Request body is too large', 'IMAGE_TOO_LARGE', 413)
+    except Exception as e:
+        return error_response(f'Error uploading image: {str(e)}', 'IMAGE_UPLOAD_ERROR', 500)
+
 # Orders endpoints
 @api_bp.route('/orders', methods=['GET'])
 def get_all_orders():
@@ -126,7 +297,7 @@ def get_all_orders():
             orders = get_orders_by_email(email)
         else:
             orders = get_orders()
-        return success_response([dict(order) for order in orders])
+        return raw_success_response(encode_records(orders))
     except Exception as e:
         return error_response(str(e), 'ORDER_RETRIEVAL_ERROR', 500)
 
@@ -155,15 +326,19 @@ def get_order(order_id):
         order, items = get_order_details(order_id)
         if not order:
             return error_response('Order not found', 'ORDER_NOT_FOUND', 404)
-        return success_response({
-            'order': dict(order),
-            'items': [dict(item) for item in items]
-        })
+        return raw_success_response(f'{{"items":{encode_records(items)},"order":{order.to_json()}}}')
     except Exception as e:
         return error_response(str(e), 'ORDER_RETRIEVAL_ERROR', 500)
 
+def _order_created(order_id):
+    return success_response({
+        'order_id': order_id,
+        'message': 'Order created successfully'
+    }, status_code=201)
+
 @api_bp.route('/orders', methods=['POST'])
 @require_json('email', 'address', 'cart')
+@idempotent('api_orders', rebuild=_order_created)
 def create_order():
     """
     Створити нове замовлення
@@ -171,6 +346,11 @@ def create_order():
     tags:
       - Orders
     parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Унікальний ключ запиту; повтор з тим самим ключем повертає збережену відповідь без створення нового замовлення
       - name: body
         in: body
         required: true
@@ -192,22 +372,30 @@ def create_order():
               example: "+380123456789"
             cart:
               type: object
+              description: "{\"12\": {\"id\": 12, \"quantity\": 2}} — ціни беруться з каталогу"
     responses:
       201:
         description: Замовлення успішно створено
       400:
-        description: Відсутні обов'язкові поля
+        description: Відсутні обов'язкові поля або некоректний кошик
+      409:
+        description: Запит з цим Idempotency-Key ще виконується
+      422:
+        description: Idempotency-Key вже використано з іншим запитом
       500:
         description: Помилка сервера
+      503:
+        description: "Сервер перевантажений (SERVER_OVERLOADED, admission control) або сховище ключів ідемпотентності зайняте (IDEMPOTENCY_STORE_BUSY); повторіть запит після Retry-After"
     """
     try:
         data = request.get_json()
         phone = data.get('phone', '')
-        order_id = add_order(data['email'], data['address'], data['cart'], phone)
-        return success_response({
-            'order_id': order_id,
-            'message': 'Order created successfully'
-        }, status_code=201)
+        order_id = add_order(data['email'], data['address'], data['cart'], phone,
+                             idempotency_key=g.get('idempotency_key'))
+        g.idempotency_committed = True
+        return _order_created(order_id)
+    except CartError as e:
+        return error_response(str(e), 'INVALID_CART', 400)
     except Exception as e:
         return error_response(f'Error creating order: {str(e)}', 'ORDER_CREATION_ERROR', 500)
 
@@ -292,10 +480,7 @@ def get_all_feedback():
         description: Помилка сервера
     """
     try:
-        conn = get_db_connection()
-        feedback = conn.execute('SELECT * FROM feedback ORDER BY id DESC').fetchall()
-        conn.close()
-        return success_response([dict(f) for f in feedback])
+        return raw_success_response(encode_records(get_feedback()))
     except Exception as e:
         return error_response(str(e), 'FEEDBACK_RETRIEVAL_ERROR', 500)
 
@@ -337,14 +522,7 @@ def create_feedback():
     """
     try:
         data = request.get_json()
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO feedback (name, email, message) VALUES (?, ?, ?)',
-            (data['name'], data['email'], data['message'])
-        )
-        conn.commit()
-        feedback_id = conn.lastrowid
-        conn.close()
+        feedback_id = add_feedback(data['name'], data['email'], data['message'])
         return success_response({
             'feedback_id': feedback_id,
             'message': 'Feedback submitted successfully'
@@ -392,6 +570,112 @@ def delete_feedback(feedback_id):
     except Exception as e:
         return error_response(str(e), 'FEEDBACK_DELETE_ERROR', 500)
 
+# ============ Change feed endpoints ============
+
+def _parse_seq(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+@api_bp.route('/changes', methods=['GET'])
+def get_change_feed():
+    """
+    Отримати зміни замовлень і відгуків після вказаного seq (long-poll)
+    ---
+    tags:
+      - Changes
+    parameters:
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: Останній оброблений seq (0 — з початку журналу)
+      - name: wait
+        in: query
+        type: number
+        required: false
+        description: Скільки секунд чекати на нові зміни (0-30, за замовчуванням 0)
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Максимальна кількість змін (1-1000, за замовчуванням 500)
+    responses:
+      200:
+        description: Список змін, наступний seq і прапорець reset
+      500:
+        description: Помилка сервера
+    """
+    try:
+        since = _parse_seq(request.args.get('since'))
+        try:
+            wait = min(max(float(request.args.get('wait', 0)), 0), 30)
+        except ValueError:
+            wait = 0
+        limit = min(max(_parse_seq(request.args.get('limit')) or 500, 1), 1000)
+        if wait:
+            changes, reset = wait_for_changes(since, timeout=wait, limit=limit)
+        else:
+            changes, reset = get_changes(since, limit=limit)
+        return success_response({
+            'changes': changes,
+            'next_since': changes[-1]['seq'] if changes else since,
+            'reset': reset
+        })
+    except Exception as e:
+        return error_response(str(e), 'CHANGES_RETRIEVAL_ERROR', 500)
+
+@api_bp.route('/changes/stream', methods=['GET'])
+def stream_changes():
+    """
+    Потік змін замовлень і відгуків (Server-Sent Events)
+    ---
+    tags:
+      - Changes
+    produces:
+      - text/event-stream
+    parameters:
+      - name: since
+        in: query
+        type: integer
+        required: false
+        description: Останній оброблений seq; заголовок Last-Event-ID має пріоритет
+    responses:
+      200:
+        description: "Потік подій: id = seq, event = order|feedback|reset, data = JSON зміни"
+    """
+    since = _parse_seq(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    max_duration = current_app.config.get('CHANGE_STREAM_MAX_SECONDS', 300)
+    heartbeat = current_app.config.get('CHANGE_STREAM_HEARTBEAT_SECONDS', 15)
+
+    # The feed slot stays taken while the stream is open, not just until this view returns
+    release_slot = hold_admission_slot()
+
+    def events(since):
+        # The stream ends after max_duration; EventSource reconnects with Last-Event-ID
+        deadline = time.monotonic() + max_duration
+        try:
+            yield 'retry: 2000\n\n'
+            while time.monotonic() < deadline:
+                changes, reset = wait_for_changes(since, timeout=heartbeat)
+                if reset:
+                    yield 'event: reset\ndata: {}\n\n'
+                if not changes:
+                    yield ': keep-alive\n\n'
+                    continue
+                for change in changes:
+                    since = change['seq']
+                    yield f"id: {since}\nevent: {change['entity']}\ndata: {json.dumps(change, ensure_ascii=False)}\n\n"
+        finally:
+            release_slot()
+
+    response = Response(events(since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also covers a client that disconnects before the generator is first iterated
+    response.call_on_close(release_slot)
+    return response
+
 # ============ Health check endpoint ============
 
 @api_bp.route('/health', methods=['GET'])
@@ -403,6 +687,12 @@ def health_check():
       - System
     responses:
       200:
-        description: API працює
+        description: API працює (разом з лічильниками admission control і станом обслуговування БД)
     """
-    return success_response({'status': 'API is running'})
+    data = {'status': 'API is running'}
+    admission = current_app.extensions.get('admission')
+    if admission:
+        data['admission'] = admission.stats()
+    if 'maintenance' in current_app.extensions:
+        data['maintenance'] = get_maintenance_status()
+    return success_response(data)
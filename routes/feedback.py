@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request, jsonify
-from models import get_db_connection
+from models import add_feedback
 
 feedback_bp = Blueprint('feedback', __name__)
 
@@ -10,12 +10,8 @@ def feedback():
         email = request.form['email']
         message = request.form['message']
         
-        conn = get_db_connection()
-        conn.execute('INSERT INTO feedback (name, email, message) VALUES (?, ?, ?)',
-                     (name, email, message))
-        conn.commit()
-        conn.close()
-        
+        add_feedback(name, email, message)
+
         return jsonify({"status": "success"}), 200
     
     return render_template('feedback.html')
\ No newline at end of file
@@ -0,0 +1,29 @@
+from flask import Blueprint, abort, send_from_directory, url_for
+from media import MEDIA_NAME_RE, media_root, variant_url
+
+media_bp = Blueprint('media', __name__)
+
+# Files are named by content hash, so a URL never changes meaning and can be cached forever
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+@media_bp.route('/media/<filename>')
+def serve(filename):
+    match = MEDIA_NAME_RE.match(filename)
+    if not match:
+        abort(404)
+    etag = match.group(0).rsplit('.', 1)[0]
+    # conditional=True gives us If-None-Match / 304 and Range / 206 handling
+    response = send_from_directory(media_root(), filename, conditional=True, etag=etag, max_age=ONE_YEAR)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@media_bp.app_template_filter('product_image')
+def product_image(url, width=400):
+    """Image URL for a product card: a local size variant when we have one,
+    otherwise the stored URL, otherwise a placeholder served from our origin."""
+    if not url:
+        return url_for('static', filename='placeholder.svg')
+    return variant_url(url, width)
@@ -1,5 +1,7 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from models import get_products, add_order, get_order_details, get_orders_by_email
+import uuid
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, g
+from models import get_products, get_product, get_products_by_ids, price_cart, add_order, get_order_details, get_orders_by_email, CartError
+from idempotency import idempotent
 
 shop_bp = Blueprint('shop', __name__)
 
@@ -23,13 +25,13 @@ def shop():
 
     has_image_flag = True if has_image_param in ('1', 'on', 'true', 'yes') else None
 
-    products = get_products(q=q or None, min_price=min_price_val, max_price=max_price_val, has_image=has_image_flag)
-    return render_template('shop.html', products=products, q=q, min_price=min_price, max_price=max_price, has_image=has_image_flag)
+    products, facets = get_products(q=q or None, min_price=min_price_val, max_price=max_price_val,
+                                    has_image=has_image_flag, facets=True)
+    return render_template('shop.html', products=products, facets=facets, q=q, min_price=min_price, max_price=max_price, has_image=has_image_flag)
 
 @shop_bp.route('/add_to_cart/<int:product_id>')
 def add_to_cart(product_id):
-    products = get_products()
-    product = next((p for p in products if p['id'] == product_id), None)
+    product = get_product(product_id)
     if product:
         cart = session.get('cart', {})
         if str(product_id) in cart:
@@ -42,26 +44,67 @@ def add_to_cart(product_id):
 @shop_bp.route('/cart')
 def cart():
     cart = session.get('cart', {})
-    total = sum(item['price'] * item['quantity'] for item in cart.values())
-    return render_template('cart.html', cart=cart, total=total)
+    # Drop products that were removed from the catalog, checkout would reject them
+    existing = get_products_by_ids(int(key) for key in cart)
+    if len(existing) != len(cart):
+        cart = {key: item for key, item in cart.items() if int(key) in existing}
+        session['cart'] = cart
+        flash('Деякі товари більше не продаються і були видалені з кошика.', 'info')
+    # Show the same catalog prices checkout will charge, not the ones saved when the item was added
+    priced = {'items': [], 'total': 0}
+    if cart:
+        try:
+            priced = price_cart(cart)
+        except CartError:
+            flash('Кошик порожній або містить товари, яких уже немає в каталозі.', 'error')
+    # A fresh key per rendered form, so a double-submitted checkout creates one order
+    return render_template('cart.html', items=priced['items'], total=priced['total'], idempotency_key=uuid.uuid4().hex)
+
+
+def _forget_checked_out_cart():
+    # Replayed checkout: the order exists, so leave the session as the original request did
+    session['user_email'] = request.form.get('email', '')
+    session['cart'] = {}
+
+
+def _checked_out(order_id):
+    flash('Замовлення оформлено успішно.', 'info')
+    return redirect(url_for('shop.orders'))
+
+
+def _checkout_unavailable():
+    flash('Помилка при оформленні замовлення. Спробуйте пізніше.', 'error')
+    return redirect(url_for('shop.cart'))
+
+
+def _checkout_busy():
+    # The idempotency key could not be checked, so the order was not even attempted
+    flash('Сервер зайнятий, спробуйте оформити замовлення ще раз за кілька секунд.', 'error')
+    return redirect(url_for('shop.cart'))
+
 
 @shop_bp.route('/checkout', methods=['POST'])
+@idempotent('checkout', on_replay=_forget_checked_out_cart, rebuild=_checked_out, on_unavailable=_checkout_busy)
 def checkout():
     cart = session.get('cart', {})
     email = request.form['email']
     address = request.form['address']
     phone = request.form.get('phone', '')
     try:
-        order_id = add_order(email, address, cart, phone)
-    except Exception as e:
-        flash('Помилка при оформленні замовлення. Спробуйте пізніше.', 'error')
+        order_id = add_order(email, address, cart, phone, idempotency_key=g.get('idempotency_key'))
+        g.idempotency_committed = True
+    except CartError:
+        flash('Кошик порожній або містить товари, яких уже немає в каталозі.', 'error')
         return redirect(url_for('shop.cart'))
+    except Exception as e:
+        # Transient failure: don't store this redirect, a retry with the same key should run again
+        g.idempotency_discard = True
+        return _checkout_unavailable()
 
     # remember user email in session so they can view order history
     session['user_email'] = email
     session['cart'] = {}
-    flash('Замовлення оформлено успішно.', 'info')
-    return redirect(url_for('shop.orders'))
+    return _checked_out(order_id)
 
 
 @shop_bp.route('/orders', methods=['GET', 'POST'])
@@ -1,4 +1,20 @@
-from models import get_db_connection, init_db
+import argparse
+import hashlib
+import os
+import random
+import struct
+import time
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import models
+from media import media_url, _write_atomic
+from models import get_db_connection, init_db, _client_search_keys, _bump_catalog_version
+
+# Solid-colour PNGs written to the media store for generated products
+SAMPLE_IMAGE_COLORS = ((66, 133, 244), (219, 68, 55), (244, 180, 0), (15, 157, 88), (171, 71, 188))
 
 def seed_products():
     init_db()  # Спочатку ініціалізуємо базу даних
@@ -15,9 +31,271 @@ def seed_products():
     ]
     
     conn.executemany('INSERT INTO products (name, price, image) VALUES (?, ?, ?)', products)
+    _bump_catalog_version(conn)
     conn.commit()
     conn.close()
 
-if __name__ == '__main__':
+
+# ============ Генератор великих детермінованих наборів даних ============
+
+LANGUAGES = ('Python', 'JavaScript', 'Java', 'C#', 'C++', 'PHP', 'Go', 'Rust', 'Kotlin', 'Swift',
+             'TypeScript', 'Ruby', 'SQL', 'HTML', 'CSS', 'Scala', 'Dart', 'Haskell', 'Elixir', 'Lua')
+LEVELS = ('для початківців', 'базовий курс', 'поглиблений курс', 'практикум', 'алгоритми',
+          'веб-розробка', 'тестування', 'архітектура', 'співбесіда', 'проєкти')
+FIRST_NAMES = ('Іван', 'Олена', 'Андрій', 'Марія', 'Дмитро', 'Ірина', 'Сергій', 'Наталія', 'Олег', 'Тетяна',
+               'Максим', 'Юлія', 'Артем', 'Катерина', 'Богдан', 'Софія', 'Тарас', 'Анна', 'Віктор', 'Оксана')
+LAST_NAMES = ('Шевченко', 'Коваленко', 'Бондаренко', 'Ткаченко', 'Кравченко', 'Олійник', 'Шевчук', 'Поліщук',
+              'Бойко', 'Мельник', 'Петренко', 'Савченко', 'Руденко', 'Мороз', 'Лисенко', 'Марченко')
+LATIN_FIRST = ('ivan', 'olena', 'andrii', 'mariia', 'dmytro', 'iryna', 'serhii', 'nataliia', 'oleh', 'tetiana',
+               'maksym', 'yuliia', 'artem', 'kateryna', 'bohdan', 'sofiia', 'taras', 'anna', 'viktor', 'oksana')
+LATIN_LAST = ('shevchenko', 'kovalenko', 'bondarenko', 'tkachenko', 'kravchenko', 'oliinyk', 'shevchuk', 'polishchuk',
+              'boiko', 'melnyk', 'petrenko', 'savchenko', 'rudenko', 'moroz', 'lysenko', 'marchenko')
+CITIES = ('Київ', 'Львів', 'Харків', 'Одеса', 'Дніпро', 'Запоріжжя', 'Вінниця', 'Полтава', 'Чернігів', 'Ужгород')
+STREETS = ('Шевченка', 'Франка', 'Лесі Українки', 'Грушевського', 'Незалежності', 'Соборна', 'Центральна', 'Садова')
+STATUSES = ('Нове', 'В обробці', 'Відправлено', 'Доставлено', 'Скасовано')
+STATUS_WEIGHTS = (8, 7, 15, 60, 10)
+# Кількість позицій у замовленні та кількість одного товару в позиції
+ITEMS_PER_ORDER = (1, 2, 3, 4, 5)
+ITEMS_PER_ORDER_WEIGHTS = (50, 25, 13, 8, 4)
+QUANTITIES = (1, 2, 3)
+QUANTITY_WEIGHTS = (80, 15, 5)
+FEEDBACK_MESSAGES = ('Дуже задоволений курсом!', 'Швидка доставка, дякую.', 'Матеріал складний, але корисний.',
+                     'Хотілося б більше практики.', 'Чудова підтримка.', 'Чекаю на продовження курсу.')
+# Частка замовлень від покупців, яких немає в таблиці clients (гостьові замовлення)
+GUEST_ORDER_SHARE = 0.1
+TABLES = ('products', 'clients', 'orders', 'order_items', 'feedback')
+
+
+def product_name(i):
+    return f'{LANGUAGES[i % len(LANGUAGES)]}: {LEVELS[(i // len(LANGUAGES)) % len(LEVELS)]}, том {i // 200 + 1}'
+
+
+def client_name(i):
+    return f'{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]}'
+
+
+def client_email(i):
+    return f'{LATIN_FIRST[i % len(LATIN_FIRST)]}.{LATIN_LAST[(i // len(LATIN_FIRST)) % len(LATIN_LAST)]}{i}@example.com'
+
+
+def zipf_cum_weights(n, s=1.1):
+    """Cumulative weights for rank-based popularity: a few items get most of the traffic."""
+    return list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _solid_png(width, height, rgb):
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    raw = (b'\x00' + bytes(rgb) * width) * height
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 9)) + chunk(b'IEND', b''))
+
+
+def sample_images(media_root):
+    """Write the sample images into the content-addressed media store and return their URLs."""
+    os.makedirs(media_root, exist_ok=True)
+    urls = []
+    for rgb in SAMPLE_IMAGE_COLORS:
+        data = _solid_png(200, 200, rgb)
+        filename = f'{hashlib.sha256(data).hexdigest()}.png'
+        path = os.path.join(media_root, filename)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        urls.append(media_url(filename))
+    return urls
+
+
+def _next_id(conn, table):
+    return (conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0) + 1
+
+
+def _load(conn, table, sql, rows, batch_size):
+    """Insert rows with executemany, committing once per batch."""
+    started = time.perf_counter()
+    total = 0
+    for batch in batched(rows, batch_size):
+        conn.executemany(sql, batch)
+        conn.commit()
+        total += len(batch)
+    elapsed = time.perf_counter() - started
+    print(f'  {table}: {total} рядків за {elapsed:.1f} с ({total / elapsed if elapsed else 0:,.0f} рядків/с)')
+    return total
+
+
+def generate_dataset(products=1000, clients=1000, orders=10000, feedback=1000, seed=42,
+                     days=730, batch_size=50000, reset=True, media_root=None):
+    """Generate a deterministic dataset of the given size and bulk-load it.
+    With reset (the default) the data tables are emptied first and the same seed and
+    sizes always produce the same rows. With reset=False the rows are appended and
+    ids, client names and emails continue after the existing rows. About 70% of the
+    products get one of a few sample images written to media_root (MEDIA_ROOT or
+    ./media by default), the rest have no image. Secondary indexes are
+    dropped for the load and rebuilt afterwards; the connection runs with
+    synchronous=OFF, so a crash during the load can corrupt the database —
+    only point this at a scratch/dev database.
+    """
+    init_db()
+    rng = random.Random(seed)
+    conn = get_db_connection()
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -262144')
+
+    if reset:
+        for table in TABLES:
+            conn.execute(f'DELETE FROM {table}')
+        _bump_catalog_version(conn)
+        conn.commit()
+
+    # Defer index maintenance: drop secondary indexes now, recreate them after the load
+    indexes = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                           "AND tbl_name IN ('products', 'clients', 'orders', 'order_items', 'feedback')").fetchall()
+    for index in indexes:
+        conn.execute(f'DROP INDEX IF EXISTS "{index["name"]}"')
+    conn.commit()
+
+    started = time.perf_counter()
+    print(f'Генерація даних (seed={seed}) у {models.DATABASE}:')
+
+    first_product_id = _next_id(conn, 'products')
+    # Prices in kopecks, kept for pricing order items without re-reading products
+    prices = array('q', (rng.randrange(49, 4999) * 100 + 99 for _ in range(products)))
+
+    images = sample_images(media_root or os.environ.get('MEDIA_ROOT') or
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+
+    def product_rows():
+        for i in range(products):
+            image = '' if rng.random() < 0.3 else images[i % len(images)]
+            yield (first_product_id + i, product_name(i), prices[i] / 100, image)
+
+    _load(conn, 'products', 'INSERT INTO products (id, name, price, image) VALUES (?, ?, ?, ?)',
+          product_rows(), batch_size)
+    _bump_catalog_version(conn)
+    conn.commit()
+
+    first_client_id = _next_id(conn, 'clients')
+
+    def client_rows():
+        for i in range(clients):
+            name = client_name(first_client_id + i)
+            email = client_email(first_client_id + i)
+            phone = f'+380{rng.choice((50, 63, 66, 67, 68, 73, 93, 95, 96, 97, 98, 99))}{rng.randrange(10 ** 7):07d}'
+            address = f'м. {rng.choice(CITIES)}, вул. {rng.choice(STREETS)}, {rng.randrange(1, 200)}'
+            yield (first_client_id + i, name, email, phone, address, 1 if rng.random() < 0.4 else 0) \
+                + _client_search_keys(name, email, phone)
+
+    _load(conn, 'clients', 'INSERT INTO clients (id, name, email, phone, address, has_courses, name_lower, email_lower, phone_normalized) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', client_rows(), batch_size)
+
+    first_order_id = _next_id(conn, 'orders')
+    first_item_id = _next_id(conn, 'order_items')
+    product_weights = zipf_cum_weights(products) if products else None
+    client_weights = zipf_cum_weights(clients) if clients else None
+    status_weights = list(accumulate(STATUS_WEIGHTS))
+    items_weights = list(accumulate(ITEMS_PER_ORDER_WEIGHTS))
+    quantity_weights = list(accumulate(QUANTITY_WEIGHTS))
+    end_date = datetime(2025, 11, 25)
+    span_seconds = days * 24 * 60 * 60
+    order_items = []
+
+    def order_rows():
+        item_id = first_item_id
+        for i in range(orders):
+            order_id = first_order_id + i
+            if clients and rng.random() >= GUEST_ORDER_SHARE:
+                # Repeat customers: client popularity follows the same skewed distribution
+                email = client_email(first_client_id + rng.choices(range(clients), cum_weights=client_weights)[0])
+            else:
+                email = f'guest{rng.randrange(10 ** 9)}@example.com'
+            n_items = rng.choices(ITEMS_PER_ORDER, cum_weights=items_weights)[0] if products else 0
+            total_cents = 0
+            for index in rng.choices(range(products), cum_weights=product_weights, k=n_items) if n_items else ():
+                quantity = rng.choices(QUANTITIES, cum_weights=quantity_weights)[0]
+                line_cents = prices[index] * quantity
+                total_cents += line_cents
+                order_items.append((item_id, order_id, first_product_id + index, quantity,
+                                    prices[index] / 100, product_name(index), line_cents / 100))
+                item_id += 1
+            date = end_date - timedelta(seconds=rng.randrange(span_seconds))
+            yield (order_id, email, f'м. {rng.choice(CITIES)}, вул. {rng.choice(STREETS)}, {rng.randrange(1, 200)}',
+                   total_cents / 100, rng.choices(STATUSES, cum_weights=status_weights)[0],
+                   date.strftime('%Y-%m-%d %H:%M:%S'), '')
+
+    def item_rows():
+        # Orders are generated batch by batch; flush their items right behind them
+        for batch in batched(order_rows(), batch_size):
+            conn.executemany('INSERT INTO orders (id, email, address, total_price, status, date, phone) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            yield from order_items
+            order_items.clear()
+
+    orders_started = time.perf_counter()
+    n_items = _load(conn, 'order_items', 'INSERT INTO order_items (id, order_id, product_id, quantity, unit_price, product_name, line_total) '
+                                         'VALUES (?, ?, ?, ?, ?, ?, ?)', item_rows(), batch_size)
+    conn.commit()
+    print(f'  orders: {orders} рядків (разом з {n_items} позиціями за {time.perf_counter() - orders_started:.1f} с)')
+
+    first_feedback_id = _next_id(conn, 'feedback')
+
+    def feedback_rows():
+        for i in range(feedback):
+            j = first_client_id + rng.randrange(max(clients, 1))
+            yield (first_feedback_id + i, client_name(j), client_email(j), rng.choice(FEEDBACK_MESSAGES))
+
+    _load(conn, 'feedback', 'INSERT INTO feedback (id, name, email, message) VALUES (?, ?, ?, ?)',
+          feedback_rows(), batch_size)
+
+    index_started = time.perf_counter()
+    for index in indexes:
+        conn.execute(index['sql'])
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    print(f'  індекси та ANALYZE: {time.perf_counter() - index_started:.1f} с')
+    print(f'Готово за {time.perf_counter() - started:.1f} с')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Тестові дані для магазину')
+    sub = parser.add_subparsers(dest='command')
+    gen = sub.add_parser('generate', help='згенерувати детермінований набір даних заданого розміру')
+    gen.add_argument('--products', type=int, default=1000)
+    gen.add_argument('--clients', type=int, default=1000)
+    gen.add_argument('--orders', type=int, default=10000)
+    gen.add_argument('--feedback', type=int, default=1000)
+    gen.add_argument('--seed', type=int, default=42)
+    gen.add_argument('--days', type=int, default=730, help='розкид дат замовлень (днів до 2025-11-25)')
+    gen.add_argument('--batch-size', type=int, default=50000, help='рядків на executemany / транзакцію')
+    gen.add_argument('--db', help='шлях до бази даних (за замовчуванням DATABASE або db.sqlite)')
+    gen.add_argument('--append', action='store_true',
+                     help='додати дані до наявних замість очищення таблиць (id та email продовжують існуючі)')
+    gen.add_argument('--media-root', help='каталог для зображень товарів (за замовчуванням MEDIA_ROOT або ./media)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        if args.db:
+            models.DATABASE = args.db
+        generate_dataset(products=args.products, clients=args.clients, orders=args.orders,
+                         feedback=args.feedback, seed=args.seed, days=args.days,
+                         batch_size=args.batch_size, reset=not args.append, media_root=args.media_root)
+        return
+
     seed_products()
-    print("Тестові продукти додано до бази даних.")
\ No newline at end of file
+    print("Тестові продукти додано до бази даних.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+"""Concurrency stress test for the checkout path.
+
+Runs several processes, each with several threads, against a throwaway SQLite
+database through the Flask test client: cart adds + /checkout, POST
+/api/v1/orders (with idempotent retries), admin status updates and admin
+deletes. Every thread only touches orders it created itself, so at the end the
+expected state is known exactly and is checked against the database: no lost
+or duplicated orders, correct order_items, nothing left behind by deletes, one
+change_log entry per event. Prints sustained orders/sec, the lock-timeout rate
+and latencies; exits with 1 if any check fails.
+
+    python stress_checkout.py --processes 4 --threads 8 --iterations 50
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+STATUSES = ('Обробляється', 'Відправлено', 'Доставлено', 'Скасовано')
+# Relative weights of what a simulated user does on each iteration
+ACTIONS = {
+    'checkout': 5,
+    'api_order': 3,
+    'status': 2,
+    'delete': 1,
+}
+# Share of order submissions that are sent twice with the same idempotency key
+DOUBLE_SUBMIT_RATE = 0.1
+
+
+def _configure_env(db_path, db_timeout):
+    # Must run before models/app are imported: both read these at import time
+    os.environ['DATABASE'] = db_path
+    os.environ['DB_TIMEOUT'] = str(db_timeout)
+    os.environ['MAINTENANCE_ENABLED'] = '0'
+
+
+def _is_lock_error(message):
+    message = (message or '').lower()
+    return 'locked' in message or 'busy' in message
+
+
+class _Worker:
+    """One simulated user: its own shop and admin sessions and its own ledger of orders."""
+
+    def __init__(self, app, name, product_ids, seed, local):
+        self.app = app
+        self.name = name
+        self.product_ids = product_ids
+        self.rng = random.Random(seed)
+        self.local = local
+        self.shop = app.test_client()
+        self.admin = app.test_client()
+        with self.admin.session_transaction() as s:
+            s['admin_logged_in'] = True
+        self.ledger = {}
+        self.failed_emails = []
+        self.counts = defaultdict(Counter)
+        self.latencies = defaultdict(list)
+        self.violations = []
+        self._n = 0
+
+    def _random_cart(self):
+        picks = Counter(self.rng.choice(self.product_ids) for _ in range(self.rng.randint(1, 4)))
+        return dict(picks)
+
+    def _request(self, action, client, method, url, **kwargs):
+        self.local.exception = None
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        if response.status_code == 503 and response.is_json and response.get_json().get('code') == 'IDEMPOTENCY_STORE_BUSY':
+            self.counts[action]['key_busy'] += 1
+        elif response.status_code in (429, 503):
+            self.counts[action]['shed'] += 1
+        elif response.status_code >= 500:
+            exc = self.local.exception
+            self.counts[action]['lock_timeout' if exc is not None and _is_lock_error(str(exc)) else 'error'] += 1
+        else:
+            self.latencies[action].append(elapsed)
+        return response
+
+    def _live_orders(self):
+        return [order_id for order_id, entry in self.ledger.items() if entry['deleted'] is False]
+
+    def checkout(self):
+        import models
+        for product_id, quantity in self._random_cart().items():
+            for _ in range(quantity):
+                self._request('add_to_cart', self.shop, 'GET', f'/add_to_cart/{product_id}')
+        # What actually made it into the session is the truth, some adds may have been shed
+        with self.shop.session_transaction() as s:
+            cart = {int(k): item['quantity'] for k, item in s.get('cart', {}).items()}
+        if not cart:
+            return
+        self._n += 1
+        email = f'{self.name}-{self._n}@stress.test'
+        data = {'email': email, 'address': 'Stress st. 1', 'idempotency_key': uuid.uuid4().hex}
+        self.counts['checkout']['attempts'] += 1
+        response = self._request('checkout', self.shop, 'POST', '/checkout', data=data)
+        if response.status_code == 302 and response.headers['Location'].endswith('/cart'):
+            with self.shop.session_transaction() as s:
+                messages = [message for _, message in s.pop('_flashes', [])]
+            if any('зайнятий' in m for m in messages):
+                self.counts['checkout']['key_busy'] += 1
+            else:
+                self.counts['checkout']['lock_timeout' if any('Помилка' in m for m in messages) else 'error'] += 1
+        if response.status_code == 302 and response.headers['Location'].endswith('/orders'):
+            if self.rng.random() < DOUBLE_SUBMIT_RATE:
+                self.counts['checkout']['double_submits'] += 1
+                self._request('checkout', self.shop, 'POST', '/checkout', data=data)
+            orders = models.get_orders_by_email(email)
+            if len(orders) != 1:
+                self.violations.append(f'{email}: checkout succeeded, {len(orders)} orders found')
+                return
+            self.counts['checkout']['ok'] += 1
+            self.ledger[orders[0]['id']] = {'email': email, 'items': cart, 'status': 'Нове', 'deleted': False}
+        else:
+            self.failed_emails.append(email)
+            with self.shop.session_transaction() as s:
+                s['cart'] = {}
+
+    def api_order(self):
+        self._n += 1
+        email = f'{self.name}-{self._n}@stress.test'
+        cart = self._random_cart()
+        body = {'email': email, 'address': 'Stress st. 2',
+                'cart': {str(pid): {'id': pid, 'quantity': qty} for pid, qty in cart.items()}}
+        headers = {'Idempotency-Key': uuid.uuid4().hex}
+        self.counts['api_order']['attempts'] += 1
+        response = self._request('api_order', self.shop, 'POST', '/api/v1/orders', json=body, headers=headers)
+        if response.status_code == 500 and response.is_json and _is_lock_error(response.get_json().get('error')):
+            self.counts['api_order']['lock_timeout'] += 1
+            self.counts['api_order']['error'] -= 1
+        if response.status_code != 201:
+            self.failed_emails.append(email)
+            return
+        order_id = response.get_json()['data']['order_id']
+        if self.rng.random() < DOUBLE_SUBMIT_RATE:
+            self.counts['api_order']['double_submits'] += 1
+            retry = self._request('api_order', self.shop, 'POST', '/api/v1/orders', json=body, headers=headers)
+            if retry.status_code == 201 and retry.get_json()['data']['order_id'] != order_id:
+                self.violations.append(f'{email}: idempotent retry created order {retry.get_json()["data"]["order_id"]}')
+        self.counts['api_order']['ok'] += 1
+        self.ledger[order_id] = {'email': email, 'items': cart, 'status': 'Нове', 'deleted': False}
+
+    def status(self):
+        live = self._live_orders()
+        if not live:
+            return
+        order_id = self.rng.choice(live)
+        status = self.rng.choice(STATUSES)
+        self.counts['status']['attempts'] += 1
+        response = self._request('status', self.admin, 'POST', f'/admin/update_order_status/{order_id}',
+                                 data={'status': status})
+        if response.status_code == 302:
+            self.counts['status']['ok'] += 1
+            self.ledger[order_id]['status'] = status
+        elif response.status_code >= 500:
+            # The update may or may not have been committed
+            self.ledger[order_id]['status'] = None
+
+    def delete(self):
+        live = self._live_orders()
+        if not live:
+            return
+        order_id = self.rng.choice(live)
+        self.counts['delete']['attempts'] += 1
+        response = self._request('delete', self.admin, 'POST', f'/admin/delete_order/{order_id}')
+        if response.status_code == 302:
+            self.counts['delete']['ok'] += 1
+            self.ledger[order_id]['deleted'] = True
+        elif response.status_code >= 500:
+            self.ledger[order_id]['deleted'] = None
+
+    def run(self, iterations, barrier):
+        actions = list(ACTIONS)
+        weights = list(ACTIONS.values())
+        barrier.wait()
+        for _ in range(iterations):
+            getattr(self, self.rng.choices(actions, weights)[0])()
+
+
+def run_process(process_no, options, barrier, results):
+    """Body of one worker process: import the app against the stress database and run the threads."""
+    _configure_env(options['db_path'], options['db_timeout'])
+    import logging
+    from flask import got_request_exception
+    import models
+    from app import app
+
+    # Unhandled view errors are counted, not printed
+    app.logger.setLevel(logging.CRITICAL)
+    local = threading.local()
+
+    def remember_exception(sender, exception, **extra):
+        local.exception = exception
+    got_request_exception.connect(remember_exception, app)
+
+    admission = app.extensions['admission']
+    # Every simulated user shares 127.0.0.1, so the per-client write rate limit would throttle the whole run
+    admission.write_buckets.rate = admission.write_buckets.burst = 1e9
+    if options['no_admission']:
+        for limiter in admission.limiters.values():
+            limiter.max_concurrent = limiter.max_queue = 10 ** 6
+
+    product_ids = [product['id'] for product in models.get_products()]
+    thread_barrier = threading.Barrier(options['threads'])
+    workers = [_Worker(app, f'p{process_no}-t{n}', product_ids, options['seed'] * 1000 + process_no * 100 + n, local)
+               for n in range(options['threads'])]
+    threads = [threading.Thread(target=worker.run, args=(options['iterations'], thread_barrier)) for worker in workers]
+
+    barrier.wait()
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finished = time.time()
+
+    counts = defaultdict(Counter)
+    latencies = defaultdict(list)
+    for worker in workers:
+        for action, counter in worker.counts.items():
+            counts[action].update(counter)
+        for action, values in worker.latencies.items():
+            latencies[action].extend(values)
+    results.put({
+        'started': started,
+        'finished': finished,
+        'ledger': {order_id: entry for worker in workers for order_id, entry in worker.ledger.items()},
+        'failed_emails': [email for worker in workers for email in worker.failed_emails],
+        'violations': [violation for worker in workers for violation in worker.violations],
+        'counts': {action: dict(counter) for action, counter in counts.items()},
+        'latencies': dict(latencies),
+        'admission': admission.stats()['classes'],
+    })
+
+
+def seed_catalog(products):
+    import models
+    models.init_db()
+    for n in range(products):
+        models.add_product(f'Stress product {n + 1}', 100 + 50 * n)
+
+
+def verify(db_path, ledger, failed_emails):
+    """Compare the database with what the workers were told. Returns a list of problems."""
+    conn = sqlite3.connect(db_path)
+    problems = []
+    orders = {row[0]: row[1:] for row in conn.execute('SELECT id, email, status, total_price FROM orders')}
+    items = defaultdict(dict)
+    line_totals = defaultdict(int)
+    for order_id, product_id, quantity, line_total in conn.execute(
+            'SELECT order_id, product_id, quantity, line_total FROM order_items'):
+        if product_id in items[order_id]:
+            problems.append(f'order {order_id}: product {product_id} has several order_items rows')
+        items[order_id][product_id] = quantity
+        line_totals[order_id] += line_total
+    prices = dict(conn.execute('SELECT id, price FROM products'))
+    changes = Counter(conn.execute("SELECT entity_id, action FROM change_log WHERE entity = 'order' AND action != 'status_changed'"))
+    conn.close()
+
+    for order_id, entry in ledger.items():
+        if entry['deleted'] is True or (entry['deleted'] is None and order_id not in orders):
+            if order_id in orders:
+                problems.append(f'order {order_id}: deleted but still present')
+            if items.get(order_id):
+                problems.append(f'order {order_id}: deleted but {len(items[order_id])} order_items left')
+            if entry['deleted'] is True and changes[(order_id, 'deleted')] != 1:
+                problems.append(f'order {order_id}: {changes[(order_id, "deleted")]} "deleted" change_log entries')
+            continue
+        if order_id not in orders:
+            problems.append(f'order {order_id} ({entry["email"]}): lost')
+            continue
+        email, status, total_price = orders[order_id]
+        if email != entry['email']:
+            problems.append(f'order {order_id}: email {email!r}, expected {entry["email"]!r}')
+        if entry['status'] is not None and status != entry['status']:
+            problems.append(f'order {order_id}: status {status!r}, expected {entry["status"]!r}')
+        if items.get(order_id, {}) != entry['items']:
+            problems.append(f'order {order_id}: items {items.get(order_id)}, expected {entry["items"]}')
+        expected_total = sum(prices[pid] * qty for pid, qty in entry['items'].items())
+        if total_price != expected_total or line_totals[order_id] != expected_total:
+            problems.append(f'order {order_id}: total {total_price} / lines {line_totals[order_id]}, expected {expected_total}')
+        if changes[(order_id, 'created')] != 1:
+            problems.append(f'order {order_id}: {changes[(order_id, "created")]} "created" change_log entries')
+
+    emails = Counter(email for email, _, _ in orders.values())
+    for email, count in emails.items():
+        if count > 1:
+            problems.append(f'{email}: {count} orders (duplicate)')
+    for email in failed_emails:
+        if emails[email]:
+            problems.append(f'{email}: request reported failure but the order exists')
+    unknown = set(orders) - set(ledger)
+    if unknown:
+        problems.append(f'{len(unknown)} orders nobody was told about: {sorted(unknown)[:10]}')
+    orphans = set(items) - set(orders)
+    orphans = {order_id for order_id in orphans if items[order_id]}
+    if orphans:
+        problems.append(f'order_items for missing orders: {sorted(orphans)[:10]}')
+    return problems
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(results, wall):
+    counts = defaultdict(Counter)
+    latencies = defaultdict(list)
+    for result in results:
+        for action, counter in result['counts'].items():
+            counts[action].update(counter)
+        for action, values in result['latencies'].items():
+            latencies[action].extend(values)
+
+    print(f'\n{"action":<12}{"attempts":>9}{"ok":>7}{"shed":>7}{"busy":>6}{"locked":>8}{"errors":>8}'
+          f'{"p50 ms":>9}{"p95 ms":>9}{"max ms":>9}')
+    for action in ('add_to_cart', *ACTIONS):
+        counter = counts[action]
+        values = latencies[action]
+        attempts = (counter['attempts'] or
+                    len(values) + counter['shed'] + counter['key_busy'] + counter['lock_timeout'] + counter['error'])
+        print(f'{action:<12}{attempts:>9}{counter["ok"] or len(values):>7}{counter["shed"]:>7}{counter["key_busy"]:>6}'
+              f'{counter["lock_timeout"]:>8}{counter["error"]:>8}'
+              f'{_percentile(values, 0.5) * 1000:>9.1f}{_percentile(values, 0.95) * 1000:>9.1f}'
+              f'{max(values, default=0) * 1000:>9.1f}')
+
+    created = counts['checkout']['ok'] + counts['api_order']['ok']
+    writes = sum(counts[action]['attempts'] for action in ACTIONS)
+    locked = sum(counts[action]['lock_timeout'] for action in ACTIONS)
+    shed = sum(counts[action]['shed'] for action in ACTIONS)
+    key_busy = sum(counts[action]['key_busy'] for action in ACTIONS)
+    print(f'\nOrders created: {created} in {wall:.2f} s — {created / wall if wall else 0:.1f} orders/sec sustained')
+    print(f'Lock timeouts: {locked} of {writes} writes ({100 * locked / writes if writes else 0:.2f}%)')
+    print(f'Shed by admission control (503 SERVER_OVERLOADED / 429 RATE_LIMITED): {shed} of {writes} writes '
+          f'({100 * shed / writes if writes else 0:.2f}%)')
+    print(f'Idempotency key store busy (503 IDEMPOTENCY_STORE_BUSY): {key_busy} of {writes} writes '
+          f'({100 * key_busy / writes if writes else 0:.2f}%)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Стрес-тест конкурентного оформлення замовлень')
+    parser.add_argument('--processes', type=int, default=4, help='кількість процесів')
+    parser.add_argument('--threads', type=int, default=8, help='потоків у кожному процесі')
+    parser.add_argument('--iterations', type=int, default=50, help='дій на кожен потік')
+    parser.add_argument('--products', type=int, default=20, help='товарів у тестовому каталозі')
+    parser.add_argument('--db-timeout', type=float, default=5.0, help='busy timeout SQLite, с')
+    parser.add_argument('--seed', type=int, default=1, help='seed для відтворюваності')
+    parser.add_argument('--no-admission', action='store_true', help='зняти ліміти admission control')
+    parser.add_argument('--keep-db', action='store_true', help='не видаляти тимчасову базу')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='stress-checkout-')
+    db_path = os.path.join(workdir, 'stress.sqlite')
+    _configure_env(db_path, args.db_timeout)
+    seed_catalog(args.products)
+
+    options = {
+        'db_path': db_path,
+        'db_timeout': args.db_timeout,
+        'threads': args.threads,
+        'iterations': args.iterations,
+        'seed': args.seed,
+        'no_admission': args.no_admission,
+    }
+    print(f'{args.processes} processes x {args.threads} threads x {args.iterations} iterations, database {db_path}')
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(args.processes)
+    queue = ctx.Queue()
+    processes = [ctx.Process(target=run_process, args=(n, options, barrier, queue)) for n in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Read before join: a child can't exit while its result is still in the pipe
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    wall = max(r['finished'] for r in results) - min(r['started'] for r in results)
+    ledger = {order_id: entry for r in results for order_id, entry in r['ledger'].items()}
+    problems = [violation for r in results for violation in r['violations']]
+    problems += verify(db_path, ledger, [email for r in results for email in r['failed_emails']])
+    report(results, wall)
+
+    if args.keep_db:
+        print(f'Database kept at {db_path}')
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if problems:
+        print(f'\nFAILED: {len(problems)} consistency problems')
+        for problem in problems[:50]:
+            print(' -', problem)
+        return 1
+    live = sum(1 for entry in ledger.values() if entry['deleted'] is False)
+    print(f'\nOK: {len(ledger)} orders checked ({live} live), no lost or duplicated orders')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
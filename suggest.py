@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from models import get_db_connection, get_catalog_version
+
+DEFAULT_LIMIT = 10
+# How often a request may check the catalog version for writes made by other processes
+VERSION_CHECK_INTERVAL = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    return ' '.join((text or '').casefold().split())
+
+
+def _word_keys(name):
+    """Every word-start suffix of the normalized name, so "pyt" finds "Курси по Python"."""
+    key = normalize(name)
+    keys = [key]
+    for i, ch in enumerate(key):
+        if ch == ' ':
+            keys.append(key[i + 1:])
+    return keys
+
+
+def _suggest_from_db(prefix, limit):
+    # Used only until the in-memory index is built; LIKE folds ASCII case only
+    conn = get_db_connection()
+    rows = conn.execute('SELECT id, name, price, image FROM products WHERE name LIKE ? OR name LIKE ? LIMIT ?',
+                        (f'{prefix}%', f'% {prefix}%', limit)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+class ProductNameIndex:
+    """In-memory prefix index of product names for search-as-you-type.
+
+    A sorted list of (key, product_id) pairs, one per word start in the name,
+    searched with bisect. Admin product routes update it incrementally; writes
+    from other processes are noticed through catalog_version (checked at most
+    every VERSION_CHECK_INTERVAL seconds) and trigger a rebuild in a background
+    thread while requests keep using the current index. Until the first build
+    has finished (start() kicks it off at app startup) suggestions come from a
+    bounded LIKE query instead.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._products = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def rebuild(self):
+        conn = get_db_connection()
+        # One read transaction, so the version matches the rows it was read with
+        conn.execute('BEGIN')
+        version = conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+        rows = conn.execute('SELECT id, name, price, image FROM products').fetchall()
+        conn.rollback()
+        conn.close()
+        products = {row['id']: (row['name'], row['price'], row['image']) for row in rows}
+        entries = sorted((key, product_id) for product_id, (name, _, _) in products.items() for key in _word_keys(name))
+        with self._lock:
+            self._products = products
+            self._entries = entries
+            self._version = version[0] if version else 0
+            self._checked_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error('Could not rebuild the product name index: %s', e)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def start(self):
+        """Rebuild in a background thread unless a rebuild is already running."""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name='product-name-index', daemon=True).start()
+
+    def _ensure_fresh(self):
+        if self._version is None:
+            self.start()
+            return
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if get_catalog_version() != self._version:
+            self.start()
+
+    def _remove_locked(self, product_id):
+        old = self._products.pop(product_id, None)
+        if old is None:
+            return
+        for key in _word_keys(old[0]):
+            i = bisect_left(self._entries, (key, product_id))
+            if i < len(self._entries) and self._entries[i] == (key, product_id):
+                del self._entries[i]
+
+    def upsert(self, product_id, name, price, image=''):
+        """Apply a product insert/update made by this process (one catalog_version bump)."""
+        with self._lock:
+            if self._version is None:
+                return
+            self._remove_locked(product_id)
+            self._products[product_id] = (name, price, image)
+            for key in _word_keys(name):
+                insort(self._entries, (key, product_id))
+            self._version += 1
+
+    def remove(self, product_id):
+        """Apply a product delete made by this process (one catalog_version bump)."""
+        with self._lock:
+            if self._version is None:
+                return
+            self._remove_locked(product_id)
+            self._version += 1
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        """Return up to `limit` products whose name, or a word in it, starts with `prefix`."""
+        self._ensure_fresh()
+        key = normalize(prefix)
+        if not key:
+            return []
+        if self._version is None:
+            return _suggest_from_db(prefix.strip(), limit)
+        results = []
+        seen = set()
+        with self._lock:
+            entries = self._entries
+            i = bisect_left(entries, (key,))
+            while i < len(entries) and len(results) < limit:
+                entry_key, product_id = entries[i]
+                if not entry_key.startswith(key):
+                    break
+                if product_id not in seen:
+                    seen.add(product_id)
+                    name, price, image = self._products[product_id]
+                    results.append({'id': product_id, 'name': name, 'price': price, 'image': image})
+                i += 1
+        return results
+
+
+product_index = ProductNameIndex()